@@ -1,6 +1,6 @@
+import time
+
 import streamlit as st
-import numpy as np
-from PIL import Image
 
 # 1. PAGE CONFIG - MUST BE FIRST STREAMLIT COMMAND
 st.set_page_config(
@@ -10,38 +10,110 @@ st.set_page_config(
     initial_sidebar_state="auto"
 )
 
-# Import our modules
-from emotion_model.emotion_utils import load_emotion_model, detect_emotion, get_emotion_emoji
-from recommender.recommender import setup_spotify, get_music_recommendations, display_song
+# Import our modules; OpenCV and the inference runtime are only imported
+# by the background warm-up below, so the page renders right away
+import metrics
+import reporting
+from emotion_model.emotion_utils import detect_emotion, get_emotion_emoji
+from recommender.assets import DISPLAY_WAIT, get_asset_cache
+from recommender.recommender import display_song
+from recommender.session import RecommendationSession
+from resources import get_emotion_model, get_spotify_client, is_ready, warm_up
+from service_client import get_remote_client
 
-def process_image(img_file_buffer, emotion_model, spotify_client):
-    """Handle image processing and music recommendation"""
+# Library warnings and errors are shown on the page
+reporting.set_reporter(reporting.StreamlitReporter())
+
+# Start loading the model and Spotify client as soon as the server imports
+# the script; later reruns and sessions reuse the same instances
+if get_remote_client() is None:
+    warm_up(background=True)
+metrics.start_exporters()
+
+def process_remote(img_file_buffer, remote):
+    """Handle image processing and music recommendation via the HTTP service"""
     with st.spinner("Analyzing your mood..."):
-        # Load and process image
-        img = Image.open(img_file_buffer)
-        img_array = np.array(img)
-        
-        # Detect emotion
-        emotion = detect_emotion(img_array, model=emotion_model)
-        
-        # Show detected emotion with styling
-        emoji = get_emotion_emoji(emotion)
-        
-        st.markdown(f"""
-            <div style='background-color: #f0f2f6; padding: 20px; border-radius: 10px; margin: 10px 0;'>
-                <h2 style='text-align: center; margin: 0;'>I see you're feeling {emotion.upper()} {emoji}</h2>
-            </div>
-        """, unsafe_allow_html=True)
+        result = remote.detect(img_file_buffer.getvalue())
+        emotion = result["emotion"]
+        show_emotion(emotion)
 
-    # Get music recommendations
     st.markdown("## 🎵 Here's some music that matches your mood:")
-    
     with st.spinner("Finding the perfect tracks for you..."):
-        songs = get_music_recommendations(emotion, sp=spotify_client)
+        songs = remote.recommend(emotion, result["probabilities"])
+    show_songs(songs)
+
+def process_image(img_file_buffer, emotion_model, spotify_client):
+    """Handle image processing and music recommendation"""
+    from emotion_model.preprocess import decode_gray
+
+    with metrics.trace("snapshot"):
+        with st.spinner("Analyzing your mood..."):
+            # Decode straight to grayscale, at reduced resolution for large photos
+            with metrics.span("decode"):
+                gray = decode_gray(img_file_buffer, reduction="auto")
+            
+            # Detect emotion
+            emotion, probabilities = detect_emotion(gray, model=emotion_model, with_probabilities=True)
+            
+            show_emotion(emotion)
+
+        # Reruns for the same photo keep its songs; "More songs" moves on
+        photo = getattr(img_file_buffer, "file_id", None) or img_file_buffer.name
+        show_recommendations(emotion, spotify_client, probabilities, key=f"snapshot:{photo}")
+
+def show_emotion(emotion):
+    """Show detected emotion with styling"""
+    emoji = get_emotion_emoji(emotion)
+
+    st.markdown(f"""
+        <div style='background-color: #f0f2f6; padding: 20px; border-radius: 10px; margin: 10px 0;'>
+            <h2 style='text-align: center; margin: 0;'>I see you're feeling {emotion.upper()} {emoji}</h2>
+        </div>
+    """, unsafe_allow_html=True)
+
+def recommendation_session():
+    """This browser session's non-repeating recommendation queues"""
+    if "recommendations" not in st.session_state:
+        st.session_state["recommendations"] = RecommendationSession()
+    return st.session_state["recommendations"]
+
+def next_songs(emotion, spotify_client, probabilities=None, key=None):
+    """Take the next songs this session has not heard yet and remember them for `key`"""
+    songs = recommendation_session().next_songs(emotion, sp=spotify_client, probabilities=probabilities)
+    st.session_state["shown_songs"] = (key, songs)
+    return songs
+
+def show_recommendations(emotion, spotify_client, probabilities=None, key=None):
+    """Display music recommendations for an emotion
+
+    With a `key`, reruns with the same key show the same songs and a
+    "More songs" button takes the next ones from the session queue.
+    """
+    st.markdown("## 🎵 Here's some music that matches your mood:")
     
+    shown = st.session_state.get("shown_songs")
+    if key is not None and shown is not None and shown[0] == key:
+        songs = shown[1]
+    else:
+        with st.spinner("Finding the perfect tracks for you..."):
+            songs = next_songs(emotion, spotify_client, probabilities, key)
+
+    show_songs(songs)
+    if key is not None and songs:
+        # The callback runs before the rerun, so the new songs show right away
+        st.button("🔀 More songs", on_click=next_songs, args=(emotion, spotify_client, probabilities, key))
+
+def show_songs(songs):
+    """Display recommended songs in a grid"""
     if not songs:
         st.warning("No songs found for your mood. Try taking another photo!")
     else:
+        assets = get_asset_cache()
+        if assets is not None:
+            # One short wait for the whole page, so new songs are usually
+            # shown from disk on their first render too
+            assets.wait_for(songs, DISPLAY_WAIT)
+
         # Display recommendations in a grid-like layout
         if len(songs) >= 3:
             cols = st.columns(3)
@@ -53,6 +125,128 @@ def process_image(img_file_buffer, emotion_model, spotify_client):
             with cols[col_idx]:
                 display_song(song)
 
+def live_mode(emotion_model, spotify_client):
+    """Continuous webcam mode: recommendations follow the smoothed mood"""
+    from emotion_model.stream import EmotionStream
+
+    try:
+        from streamlit_webrtc import VideoProcessorBase, webrtc_streamer
+    except ImportError:
+        st.info("Live mode needs streamlit-webrtc: `pip install streamlit-webrtc`")
+        return
+
+    class EmotionProcessor(VideoProcessorBase):
+        def __init__(self):
+            self.stream = EmotionStream(emotion_model).start()
+
+        def recv(self, frame):
+            # Inference runs on the stream's own thread; frames that arrive
+            # while it is busy are dropped
+            self.stream.submit(frame.to_ndarray(format="rgb24"))
+            return frame
+
+        def on_ended(self):
+            self.stream.stop()
+
+    ctx = webrtc_streamer(
+        key="live",
+        video_processor_factory=EmotionProcessor,
+        media_stream_constraints={"video": True, "audio": False},
+    )
+
+    status = st.empty()
+    music = st.empty()
+    shown_mood = None
+
+    # Poll the stream while the video is playing; only a stable mood change
+    # fetches new recommendations
+    while ctx.state.playing and ctx.video_processor is not None:
+        stream = ctx.video_processor.stream
+        if stream.last_error:
+            status.error(stream.last_error)
+        elif stream.mood is None:
+            status.info(f"Looking for your face... ({stream.fps:.1f} fps)")
+        elif stream.mood != shown_mood:
+            shown_mood = stream.mood
+            with status.container():
+                show_emotion(shown_mood)
+            with music.container():
+                show_recommendations(shown_mood, spotify_client, stream.probabilities)
+        time.sleep(0.5)
+
+def show_debug_panel(n=10):
+    """Sidebar breakdown of the last requests, when FEELTUNE_METRICS is on"""
+    if not metrics.is_enabled():
+        return
+    with st.sidebar.expander("🔍 Recent requests", expanded=False):
+        traces = metrics.recent_traces(n)
+        if not traces:
+            st.caption("No requests recorded yet")
+        for trace in traces:
+            started = time.strftime("%H:%M:%S", time.localtime(trace["started"]))
+            st.markdown(f"**{trace['name']}** at {started}: {trace['total_ms']:.1f} ms")
+            if trace["error"]:
+                st.error(trace["error"])
+            if trace["stages"]:
+                st.table([{"stage": stage, "ms": ms} for stage, ms in trace["stages"]])
+
+def run_remote(remote):
+    """Snapshot mode backed by the FeelTune HTTP service"""
+    img_file_buffer = st.camera_input("Take a picture", key="camera")
+    if img_file_buffer is not None:
+        try:
+            process_remote(img_file_buffer, remote)
+        except Exception as e:
+            st.error(f"FeelTune service error: {e}")
+
+def load_resources():
+    """Return the shared model and Spotify client, waiting for the warm-up if needed"""
+    with st.spinner("Setting up..."):
+        emotion_model = get_emotion_model()
+        spotify_client = get_spotify_client()
+        
+        if emotion_model is None:
+            st.error("❌ Failed to load emotion detection model")
+            st.info("Please make sure the model files are in the emotion_model directory")
+        
+        if spotify_client is None:
+            st.warning("⚠️ Running without Spotify API - will use local recommendations")
+            st.info("Check your .env file and internet connection")
+    return emotion_model, spotify_client
+
+def run_local():
+    """Snapshot and live modes with the model loaded in this process"""
+    # While the model is still loading in the background, show the page and
+    # only wait for it once it is needed
+    loaded = is_ready("emotion_model") and is_ready("spotify")
+    if loaded:
+        emotion_model, spotify_client = load_resources()
+    else:
+        st.info("⏳ Loading the emotion model in the background - you can already take a picture")
+        emotion_model = spotify_client = None
+
+    mode = st.radio("Mode", ["Snapshot", "Live video"], horizontal=True)
+
+    if mode == "Live video":
+        if not loaded:
+            emotion_model, spotify_client = load_resources()
+        if emotion_model is None:
+            st.error("Cannot start live mode: Emotion detection model not loaded")
+        else:
+            live_mode(emotion_model, spotify_client)
+    else:
+        # Camera input
+        img_file_buffer = st.camera_input("Take a picture", key="camera")
+
+        # Process the image if available
+        if img_file_buffer is not None:
+            if not loaded:
+                emotion_model, spotify_client = load_resources()
+            if emotion_model is None:
+                st.error("Cannot process image: Emotion detection model not loaded")
+            else:
+                process_image(img_file_buffer, emotion_model, spotify_client)
+
 def main():
     # App header with styling
     st.markdown("""
@@ -94,28 +288,13 @@ def main():
             else:
                 st.error("❌ No internet connection detected")
 
-    # Load models and services
-    with st.spinner("Setting up..."):
-        emotion_model = load_emotion_model()
-        spotify_client = setup_spotify()
-        
-        if emotion_model is None:
-            st.error("❌ Failed to load emotion detection model")
-            st.info("Please make sure the model files are in the emotion_model directory")
-        
-        if spotify_client is None:
-            st.warning("⚠️ Running without Spotify API - will use local recommendations")
-            st.info("Check your .env file and internet connection")
-
-    # Camera input
-    img_file_buffer = st.camera_input("Take a picture", key="camera")
-
-    # Process the image if available
-    if img_file_buffer is not None:
-        if emotion_model is None:
-            st.error("Cannot process image: Emotion detection model not loaded")
-        else:
-            process_image(img_file_buffer, emotion_model, spotify_client)
+    # With FEELTUNE_API_URL set, detection and recommendations run on the
+    # HTTP service and this process loads no model
+    remote = get_remote_client()
+    if remote is not None:
+        run_remote(remote)
+    else:
+        run_local()
 
     # About section
     with st.expander("About FeelTune"):
@@ -128,6 +307,8 @@ def main():
         The app connects your emotional state to music, helping you find the perfect soundtrack for your mood!
         """)
 
+    show_debug_panel()
+
     # Footer
     st.markdown("---")
     st.markdown("""
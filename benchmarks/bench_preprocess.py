@@ -0,0 +1,100 @@
+"""Compare the old and new image preprocessing paths.
+
+    python -m benchmarks.bench_preprocess [--image face.jpg] [--faces 4] [--runs 50]
+
+Old path: Image.open -> np.array (RGB) -> cvtColor -> per-face resize, float64
+/ 255 and reshape. New path: decode_gray (optionally reduced) -> crops written
+into a preallocated float32 batch. Reports mean time and peak traced memory
+per frame.
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from emotion_model.preprocess import FaceBatchBuffer, decode_gray
+
+
+def synthetic_jpeg(width=1920, height=1080, seed=0):
+    """Smooth random image encoded as JPEG, sized like a camera frame"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def face_boxes(width, height, faces):
+    size = min(width, height) // 4
+    return [((i * size) % (width - size), (i * size // 2) % (height - size), size, size) for i in range(faces)]
+
+
+def old_path(data, boxes):
+    img_array = np.array(Image.open(io.BytesIO(data)))
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    crops = []
+    for (x, y, w, h) in boxes:
+        roi = cv2.resize(gray[y:y+h, x:x+w], (48, 48)) / 255.0
+        crops.append(roi.reshape(1, 48, 48, 1))
+    return np.concatenate(crops)
+
+
+def new_path(data, boxes, buffer, reduction=1):
+    gray = decode_gray(data, reduction)
+    if reduction != 1:
+        boxes = [tuple(v // reduction for v in box) for box in boxes]
+    return buffer.fill((gray, box) for box in boxes)
+
+
+def measure(fn, runs):
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    elapsed = (time.perf_counter() - started) / runs
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(data, faces=4, runs=50):
+    width, height = Image.open(io.BytesIO(data)).size
+    boxes = face_boxes(width, height, faces)
+    buffer = FaceBatchBuffer()
+
+    cases = {
+        'old (PIL RGB, float64)': lambda: old_path(data, boxes),
+        'new (gray decode, float32 buffer)': lambda: new_path(data, boxes, buffer),
+        'new, 1/2 reduced decode': lambda: new_path(data, boxes, buffer, 2),
+        'new, 1/4 reduced decode': lambda: new_path(data, boxes, buffer, 4),
+    }
+    results = {}
+    for name, fn in cases.items():
+        elapsed, peak = measure(fn, runs)
+        results[name] = {'ms': elapsed * 1000, 'peak_kib': peak / 1024}
+    return {'width': width, 'height': height, 'faces': faces, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--image', help="JPEG to use instead of a synthetic 1920x1080 frame")
+    parser.add_argument('--faces', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    data = open(args.image, 'rb').read() if args.image else synthetic_jpeg()
+    report = run(data, args.faces, args.runs)
+    print(f"{report['width']}x{report['height']}, {report['faces']} faces")
+    for name, result in report['results'].items():
+        print(f"  {name:36s} {result['ms']:7.2f} ms   peak {result['peak_kib']:9.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""Load test: many concurrent virtual users against one FeelTune process.
+
+    python -m benchmarks.load --users 1 2 4 8 16 32 --duration 20 --think-time 2 -o load.json
+    python -m benchmarks.load --url http://127.0.0.1:8000 --users 4 16 64   # a running service.py
+
+Each virtual user is one browser session: it waits a random think time,
+snaps a photo from the fixtures and runs what app.process_image does on a
+rerun (shared resources, decode, detection, the session's recommendation
+queue), sometimes followed by a "More songs" click. Spotify is a local mock
+HTTP server that spotipy talks to, with configurable latency and failures.
+Every user count runs for --duration seconds; the report gives throughput,
+latency percentiles, errors and RSS growth per step, and the saturation
+point: the first step that adds no throughput or breaks the p95 target.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from benchmarks.bench_preprocess import synthetic_jpeg
+from recommender.stub import StubSpotify
+
+
+def current_rss_mib():
+    """Resident set size now (Linux), or the peak elsewhere"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+class MockSpotifyServer:
+    """Local HTTP stand-in for the Spotify Web API endpoints the recommender uses
+
+    Data comes from StubSpotify; album art and previews point back at this
+    server, so the asset cache is exercised without leaving the machine.
+    `latency` delays every API response and `failure_rate` answers that
+    fraction of them with a 503.
+    """
+
+    def __init__(self, latency=0.05, failure_rate=0.0, host='127.0.0.1', port=0):
+        self.stub = StubSpotify(latency=latency, failure_rate=failure_rate)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._image = synthetic_jpeg(640, 640)
+        self._preview = bytes(120 * 1024)
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-spotify", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _local_assets(self, track):
+        track['album']['images'] = [{'url': f"{self.url}/image/{track['id']}"}]
+        if track.get('preview_url'):
+            track['preview_url'] = f"{self.url}/preview/{track['id']}"
+        return track
+
+    def respond(self, path, query):
+        """Return (status, payload) for an API request"""
+        with self._lock:
+            self.requests += 1
+        try:
+            if path == '/v1/search':
+                return 200, self.stub.search(query['q'][0], limit=int(query.get('limit', ['10'])[0]))
+            if path.startswith('/v1/playlists/') and path.endswith(('/items', '/tracks')):
+                playlist_id = path.split('/')[3]
+                page = self.stub.playlist_tracks(playlist_id, limit=int(query.get('limit', ['100'])[0]),
+                                                 offset=int(query.get('offset', ['0'])[0]))
+                for item in page['items']:
+                    self._local_assets(item['track'])
+                return 200, page
+            if path.rstrip('/') == '/v1/audio-features':
+                return 200, {'audio_features': self.stub.audio_features(query['ids'][0].split(','))}
+        except ConnectionError as e:
+            return 503, {'error': {'status': 503, 'message': str(e)}}
+        return 404, {'error': {'status': 404, 'message': 'not found'}}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.startswith('/image/'):
+                    self._send(200, mock._image, "image/jpeg")
+                elif url.path.startswith('/preview/'):
+                    self._send(200, mock._preview, "audio/mpeg")
+                else:
+                    status, payload = mock.respond(url.path, parse_qs(url.query))
+                    self._send(status, json.dumps(payload).encode(), "application/json")
+
+        return Handler
+
+
+def mock_spotify_client(url):
+    """spotipy client pointed at the mock server; retries are left to recommender.fetch"""
+    from spotipy import Spotify
+
+    sp = Spotify(auth="load-test", requests_timeout=10, retries=0, status_retries=0)
+    sp.prefix = f"{url}/v1/"
+    return sp
+
+
+def load_fixtures(path=None):
+    """Encoded photos for the virtual users: JPEGs from `path`, else synthetic frames"""
+    if path:
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+        fixtures = []
+        for name in names:
+            with open(os.path.join(path, name), 'rb') as f:
+                fixtures.append(f.read())
+        if fixtures:
+            return fixtures
+    return [synthetic_jpeg(w, h, seed) for seed, (w, h) in enumerate(((640, 480), (1280, 720), (1920, 1080)))]
+
+
+class LocalTarget:
+    """The app's request path in this process, as one Streamlit rerun per snapshot"""
+
+    name = 'local'
+
+    def new_session(self):
+        from recommender.session import RecommendationSession
+
+        return RecommendationSession()
+
+    def snapshot(self, session, data):
+        import metrics
+        from emotion_model.emotion_utils import detect_emotion
+        from emotion_model.preprocess import decode_gray
+        from resources import get_emotion_model, get_spotify_client
+
+        with metrics.trace("snapshot"):
+            # A rerun looks the shared resources up again before using them
+            model = get_emotion_model()
+            sp = get_spotify_client()
+            gray = decode_gray(data, reduction="auto")
+            emotion, probabilities = detect_emotion(gray, model=model, with_probabilities=True)
+            songs = session.next_songs(emotion, sp=sp, probabilities=probabilities)
+        return emotion, probabilities, songs
+
+    def more_songs(self, session, emotion, probabilities):
+        from resources import get_spotify_client
+
+        return session.next_songs(emotion, sp=get_spotify_client(), probabilities=probabilities)
+
+
+class RemoteTarget:
+    """A running service.py, through the same client the app uses"""
+
+    name = 'remote'
+
+    def __init__(self, url):
+        self.url = url
+
+    def new_session(self):
+        from service_client import FeelTuneClient
+
+        return FeelTuneClient(self.url, timeout=30)
+
+    def snapshot(self, client, data):
+        result = client.detect(data)
+        songs = client.recommend(result["emotion"], result["probabilities"])
+        return result["emotion"], result["probabilities"], songs
+
+    def more_songs(self, client, emotion, probabilities):
+        return client.recommend(emotion, probabilities)
+
+
+def _virtual_user(target, fixtures, deadline, think_time, more_songs_rate, rng, samples, errors):
+    session = target.new_session()
+    # Users do not all arrive at the same instant
+    time.sleep(min(rng.uniform(0, think_time), max(0.0, deadline - time.monotonic())))
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            emotion, probabilities, _ = target.snapshot(session, rng.choice(fixtures))
+            samples.append(('snapshot', time.monotonic() - started))
+            if rng.random() < more_songs_rate:
+                started = time.monotonic()
+                target.more_songs(session, emotion, probabilities)
+                samples.append(('more_songs', time.monotonic() - started))
+        except Exception as e:
+            errors.append(type(e).__name__)
+        if think_time:
+            pause = rng.expovariate(1.0 / think_time)
+            time.sleep(max(0.0, min(pause, deadline - time.monotonic())))
+
+
+def _summary(latencies):
+    if not latencies:
+        return {'n': 0}
+    ms = np.asarray(latencies) * 1000
+    return {
+        'n': int(len(ms)),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+
+def run_step(target, fixtures, users, duration, think_time=2.0, more_songs_rate=0.3, seed=0):
+    """Run `users` virtual users for `duration` seconds; return the step's report"""
+    samples, errors = [], []
+    rss_before = current_rss_mib()
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [threading.Thread(target=_virtual_user, name=f"vu-{i}",
+                                args=(target, fixtures, deadline, think_time, more_songs_rate,
+                                      random.Random(seed * 1000 + i), samples, errors))
+               for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    snapshots = [seconds for kind, seconds in samples if kind == 'snapshot']
+    return {
+        'users': users,
+        'seconds': elapsed,
+        'requests': len(samples),
+        'errors': len(errors),
+        'error_types': {name: errors.count(name) for name in set(errors)},
+        'throughput_per_s': len(snapshots) / elapsed,
+        'snapshot': _summary(snapshots),
+        'more_songs': _summary([seconds for kind, seconds in samples if kind == 'more_songs']),
+        'rss_before_mib': rss_before,
+        'rss_after_mib': current_rss_mib(),
+    }
+
+
+def find_saturation(steps, min_gain=0.10, slo_ms=2000.0):
+    """First step where more users add under `min_gain` throughput, or p95 passes `slo_ms`
+
+    Returns (users, reason) for the last step before saturation, or
+    (None, None) if no step saturated.
+    """
+    for previous, step in zip([None] + steps[:-1], steps):
+        p95 = step['snapshot'].get('p95_ms')
+        if p95 is not None and p95 > slo_ms:
+            users = previous['users'] if previous else step['users']
+            return users, f"p95 {p95:.0f} ms > {slo_ms:.0f} ms at {step['users']} users"
+        if previous and step['throughput_per_s'] < previous['throughput_per_s'] * (1 + min_gain):
+            return previous['users'], (f"{step['users']} users add no throughput "
+                                       f"({previous['throughput_per_s']:.1f} -> {step['throughput_per_s']:.1f}/s)")
+    return None, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test FeelTune with concurrent virtual users")
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 2, 4, 8, 16], help="user counts to step through")
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds per step")
+    parser.add_argument('--think-time', type=float, default=2.0, help="mean seconds between a user's snapshots")
+    parser.add_argument('--more-songs-rate', type=float, default=0.3, help="chance of a \"More songs\" click")
+    parser.add_argument('--fixtures', help="directory of photos (default: synthetic frames)")
+    parser.add_argument('--url', help="drive a running service.py instead of this process")
+    parser.add_argument('--backend', default=None, help="inference backend for the local target")
+    parser.add_argument('--spotify-latency', type=float, default=0.05, help="mock Spotify seconds per call")
+    parser.add_argument('--spotify-failure-rate', type=float, default=0.0)
+    parser.add_argument('--no-result-cache', action='store_true', help="disable the perceptual-hash result cache")
+    parser.add_argument('--slo-ms', type=float, default=2000.0, help="p95 snapshot latency target")
+    parser.add_argument('-o', '--output', help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.no_result_cache:
+        os.environ['FEELTUNE_RESULT_CACHE_SIZE'] = '0'
+    if os.getenv('FEELTUNE_ASSET_DIR'):
+        return run_load_test(args)
+
+    # Downloaded assets go to a scratch directory, not the app's cache
+    with tempfile.TemporaryDirectory(prefix='feeltune-load-') as scratch:
+        os.environ['FEELTUNE_ASSET_DIR'] = scratch
+        try:
+            return run_load_test(args)
+        finally:
+            from recommender.assets import get_asset_cache
+
+            # Let running downloads finish before the directory is removed
+            assets = get_asset_cache()
+            if assets is not None:
+                assets.wait(timeout=30)
+            del os.environ['FEELTUNE_ASSET_DIR']
+
+
+def run_load_test(args):
+    """Step through the user counts of the parsed command line and print the report"""
+    fixtures = load_fixtures(args.fixtures)
+
+    mock = None
+    try:
+        if args.url:
+            target = RemoteTarget(args.url)
+        else:
+            import resources
+
+            if args.backend:
+                os.environ['FEELTUNE_BACKEND'] = args.backend
+            mock = MockSpotifyServer(args.spotify_latency, args.spotify_failure_rate).start()
+            client = mock_spotify_client(mock.url)
+            resources.registry.register("spotify", lambda: client)
+            started = time.perf_counter()
+            if resources.get_emotion_model() is None:
+                print("Could not load the emotion model", file=sys.stderr)
+                return 1
+            print(f"Model loaded in {time.perf_counter() - started:.1f}s; mock Spotify at {mock.url}")
+            target = LocalTarget()
+
+        rss_start = current_rss_mib()
+        steps = []
+        print(f"{'users':>5s} {'req/s':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'errors':>6s} {'RSS MiB':>8s}")
+        for seed, users in enumerate(args.users):
+            calls_before = mock.requests if mock else None
+            step = run_step(target, fixtures, users, args.duration, args.think_time, args.more_songs_rate, seed)
+            if mock:
+                step['spotify_requests'] = mock.requests - calls_before
+            steps.append(step)
+            snapshot = step['snapshot']
+            print(f"{users:5d} {step['throughput_per_s']:7.2f} {snapshot.get('p50_ms', 0):8.1f} "
+                  f"{snapshot.get('p95_ms', 0):8.1f} {snapshot.get('p99_ms', 0):8.1f} {step['errors']:6d} "
+                  f"{step['rss_after_mib']:8.0f}")
+    finally:
+        # A failing step must not leave the mock server's thread and port behind
+        if mock:
+            mock.stop()
+
+    saturation, reason = find_saturation(steps, slo_ms=args.slo_ms)
+    if saturation is None:
+        print(f"No saturation up to {args.users[-1]} users")
+    else:
+        print(f"Saturation at about {saturation} users: {reason}")
+    print(f"RSS growth: {current_rss_mib() - rss_start:+.0f} MiB")
+
+    if args.output:
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'target': args.url or 'local',
+            'cpu_count': os.cpu_count(),
+            'think_time': args.think_time,
+            'duration': args.duration,
+            'result_cache': not args.no_result_cache,
+            'saturation_users': saturation,
+            'saturation_reason': reason,
+            'rss_growth_mib': current_rss_mib() - rss_start,
+            'steps': steps,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""Reproducible FeelTune benchmark suite.
+
+    python -m benchmarks.run -o bench.json [--compare previous.json] [--fixtures photos/]
+
+Stages: import/startup time, model load, face detection (cascade) per
+resolution, preprocessing, model.predict per batch size, recommendations
+against a mock Spotify client (cold and warm cache, with latency and
+failures), the full headless process_image path, uncached and for a
+repeated photo, and multi-face frames through the serial path vs. the
+pipelined FacePipeline. Stages report p50/p95/p99 latency and throughput
+(the pipeline stage frames/s only); the run records peak RSS. Results are
+saved as JSON so runs can be compared.
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.bench_preprocess import synthetic_jpeg
+from benchmarks.startup import import_times
+
+RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080))
+FACE_COUNTS = (0, 1, 8)
+BATCH_SIZES = (1, 8, 32)
+# Catalog sizes the recommendation ranking is timed at
+RANKING_SIZES = (100_000, 300_000)
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        'n': int(len(samples)),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'throughput_per_s': float(1000 / samples.mean()) if samples.mean() else None,
+    }
+
+
+def time_it(fn, runs, warmup=2, setup=None):
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    samples = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def peak_rss_mib():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+class FixedFaces:
+    """Detector stand-in returning a fixed number of evenly spaced boxes
+
+    Lets preprocessing and inference be measured for 0, 1 or many faces on
+    synthetic frames, which the real cascade would find no faces in.
+    """
+
+    def __init__(self, faces):
+        self.faces = faces
+
+    def detect(self, gray):
+        height, width = gray.shape[:2]
+        size = max(48, min(width, height) // 5)
+        columns = max(1, width // size)
+        return [((i % columns) * size, ((i // columns) * size) % (height - size), size, size)
+                for i in range(self.faces)]
+
+
+class ScannedFixedFaces(FixedFaces):
+    """Runs the real detector for its cost, then reports FixedFaces boxes"""
+
+    def __init__(self, faces, detector):
+        super().__init__(faces)
+        self.detector = detector
+
+    def detect(self, gray):
+        self.detector.detect(gray)
+        return super().detect(gray)
+
+
+class StubModel:
+    """Constant-output model used when no real backend can be loaded"""
+
+    def predict(self, batch, verbose=0):
+        out = np.zeros((len(batch), 7), dtype=np.float32)
+        out[:, 6] = 1.0
+        return out
+
+
+def bench_startup():
+    """Import time of the library modules, each in a fresh interpreter"""
+    return import_times(('emotion_model.emotion_utils', 'recommender.recommender', 'app'))
+
+
+def load_model(backend):
+    from emotion_model.backends import load_backend
+
+    started = time.perf_counter()
+    try:
+        model = load_backend(backend)
+        return model, {'backend': model.name, 'load_ms': (time.perf_counter() - started) * 1000}
+    except Exception as e:
+        return StubModel(), {'backend': 'stub', 'error': str(e)}
+
+
+def bench_detection(frames, runs):
+    from emotion_model.face_detector import get_face_detector
+
+    detector = get_face_detector()
+    return {name: time_it(lambda gray=gray: detector.detect(gray), runs) for name, gray in frames.items()}
+
+
+def bench_preprocess(jpegs, runs):
+    from emotion_model.preprocess import FaceBatchBuffer, decode_gray
+
+    buffer = FaceBatchBuffer()
+    results = {}
+    for name, data in jpegs.items():
+        for faces in FACE_COUNTS:
+            detector = FixedFaces(faces)
+
+            def step(data=data, detector=detector):
+                gray = decode_gray(data)
+                buffer.fill((gray, box) for box in detector.detect(gray))
+
+            results[f"{name}/{faces}_faces"] = time_it(step, runs)
+    return results
+
+
+def bench_predict(model, runs):
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in BATCH_SIZES:
+        batch = rng.random((size, 48, 48, 1), dtype=np.float32)
+        stats = time_it(lambda batch=batch: model.predict(batch, verbose=0), runs)
+        stats['faces_per_s'] = stats['throughput_per_s'] * size
+        results[f"batch_{size}"] = stats
+    return results
+
+
+def bench_recommend(runs, latency, failure_rate):
+    from recommender.cache import get_cache
+    from recommender.pool import pool_manager
+    from recommender.recommender import get_music_recommendations
+    from recommender.stub import StubSpotify
+
+    def cold():
+        get_cache().clear()
+        pool_manager.clear()
+
+    sp = StubSpotify(latency=latency, failure_rate=failure_rate)
+    results = {'cold': time_it(lambda: get_music_recommendations('happy', sp), runs, setup=cold)}
+    # Let the background pool build finish so the warm runs hit it
+    get_music_recommendations('happy', sp)
+    time.sleep(max(1.0, latency * 20))
+    results['warm'] = time_it(lambda: get_music_recommendations('happy', sp), runs)
+    results['spotify_calls'] = sp.calls
+    return results
+
+
+def bench_ranking(runs, sizes=RANKING_SIZES, k=5):
+    """FeatureStore.top_k latency for catalogs of `sizes` tracks with random features
+
+    Queries alternate between an emotion label and a random probability
+    vector, as the app sends either.
+    """
+    from recommender.scoring import FEATURES, FeatureStore
+
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in sizes:
+        store = FeatureStore()
+        features = rng.random((size, len(FEATURES)), dtype=np.float32)
+        for i, vector in enumerate(features):
+            store.add({'id': f"track{i}"}, vector)
+        queries = itertools.cycle(['happy', 'sad'] + [rng.dirichlet(np.ones(7)) for _ in range(8)])
+        results[f"tracks_{size}"] = time_it(lambda: store.top_k(next(queries), k=k), max(runs, 200))
+    return results
+
+
+def bench_end_to_end(model, jpegs, runs, latency, cache=False):
+    """Headless equivalent of app.process_image: decode, detect, recommend
+
+    With `cache`, the faces of the same photo reuse cached probabilities
+    after the first run, as for a user snapping the same picture again.
+    """
+    from emotion_model.emotion_utils import detect_emotion
+    from emotion_model.preprocess import decode_gray
+    from emotion_model.result_cache import ResultCache
+    from recommender.recommender import get_music_recommendations
+    from recommender.stub import StubSpotify
+
+    sp = StubSpotify(latency=latency)
+    results = {}
+    for name, data in jpegs.items():
+        result_cache = ResultCache() if cache else False
+
+        def step(data=data, result_cache=result_cache):
+            gray = decode_gray(data, reduction='auto')
+            emotion, probabilities = detect_emotion(gray, model=model, with_probabilities=True,
+                                                    cache=result_cache)
+            get_music_recommendations(emotion, sp, probabilities=probabilities)
+
+        results[name] = time_it(step, runs)
+    return results
+
+
+def bench_pipeline(model, jpegs, frames=64, faces=8):
+    """Frames/s for encoded frames with `faces` faces each: serial vs. FacePipeline
+
+    The serial path decodes and analyses one frame at a time like
+    detect_emotion; the pipeline is run with 1, 2 and all cores.
+    """
+    from emotion_model.emotion_utils import detect_faces_emotions
+    from emotion_model.face_detector import get_face_detector
+    from emotion_model.pipeline import FacePipeline
+    from emotion_model.preprocess import decode_gray
+
+    detector = ScannedFixedFaces(faces, get_face_detector())
+    worker_counts = sorted({1, 2, os.cpu_count() or 1})
+    results = {}
+    for name, data in jpegs.items():
+        started = time.perf_counter()
+        for _ in range(frames):
+            detect_faces_emotions([decode_gray(data)], model=model, detector=detector)
+        stages = {'serial': frames / (time.perf_counter() - started)}
+        for workers in worker_counts:
+            with FacePipeline(model, detector, workers=workers) as pipeline:
+                list(pipeline.map([data] * 4))
+                started = time.perf_counter()
+                for _ in pipeline.map([data] * frames):
+                    pass
+                stages[f'workers_{workers}'] = frames / (time.perf_counter() - started)
+        results[name] = {key: {'frames_per_s': value} for key, value in stages.items()}
+    return results
+
+
+def compare(current, previous, threshold=0.10):
+    """Print p95 changes between two reports, flagging regressions"""
+    def walk(a, b, path):
+        for key, value in a.items():
+            if isinstance(value, dict) and isinstance(b.get(key), dict):
+                if 'p95_ms' in value and 'p95_ms' in b[key]:
+                    old, new = b[key]['p95_ms'], value['p95_ms']
+                    change = (new - old) / old if old else 0.0
+                    flag = '  REGRESSION' if change > threshold else ''
+                    print(f"  {path + key:50s} p95 {old:9.2f} -> {new:9.2f} ms ({change:+.0%}){flag}")
+                else:
+                    walk(value, b[key], f"{path}{key}/")
+
+    walk(current['stages'], previous.get('stages', {}), '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the FeelTune benchmark suite")
+    parser.add_argument('-o', '--output', default='bench.json')
+    parser.add_argument('--compare', help="previous JSON report to compare against")
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--fixtures', help="directory of real JPEG photos to add to the synthetic frames")
+    parser.add_argument('--spotify-latency', type=float, default=0.05, help="mock Spotify seconds per call")
+    parser.add_argument('--spotify-failure-rate', type=float, default=0.1)
+    parser.add_argument('--skip-startup', action='store_true')
+    args = parser.parse_args(argv)
+
+    import cv2
+
+    jpegs = {f"{w}x{h}": synthetic_jpeg(w, h) for w, h in RESOLUTIONS}
+    if args.fixtures:
+        for path in sorted(glob.glob(os.path.join(args.fixtures, '*.jp*g'))):
+            with open(path, 'rb') as f:
+                jpegs[os.path.basename(path)] = f.read()
+    frames = {name: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE) for name, data in jpegs.items()}
+
+    stages = {}
+    if not args.skip_startup:
+        stages['startup'] = bench_startup()
+    model, stages['model'] = load_model(args.backend)
+    stages['detection'] = bench_detection(frames, args.runs)
+    stages['preprocess'] = bench_preprocess(jpegs, args.runs)
+    stages['predict'] = bench_predict(model, args.runs)
+    stages['recommend'] = bench_recommend(args.runs, args.spotify_latency, args.spotify_failure_rate)
+    stages['ranking'] = bench_ranking(args.runs)
+    stages['end_to_end'] = bench_end_to_end(model, jpegs, args.runs, args.spotify_latency)
+    stages['end_to_end_repeat'] = bench_end_to_end(model, jpegs, args.runs, args.spotify_latency, cache=True)
+    stages['pipeline'] = bench_pipeline(model, jpegs)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'runs': args.runs,
+        'peak_rss_mib': peak_rss_mib(),
+        'stages': stages,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output} (peak RSS {report['peak_rss_mib']:.0f} MiB)")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
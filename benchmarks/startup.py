@@ -0,0 +1,96 @@
+"""Startup profiler: import time of the FeelTune entry points.
+
+    python -m benchmarks.startup [--top 10] [--model] [module ...]
+
+Each module is imported in a fresh interpreter with `-X importtime`. The
+report gives its total import time and the direct imports that cost the
+most. With --model, the time to load the emotion model and face detector
+through resources.py is measured as well.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = ('app', 'emotion_model.emotion_utils', 'recommender.recommender', 'service',
+                'emotion_model.batch', 'recommender.catalog')
+
+
+def parse_importtime(stderr):
+    """Return [(depth, name, self_us, cumulative_us)] from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def import_profile(module):
+    """Import `module` in a fresh interpreter; return (total_ms, direct imports by cost)"""
+    env = {**os.environ, 'FEELTUNE_API_URL': ''}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output=True, text=True, timeout=300, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = parse_importtime(result.stderr)
+    # Rows are listed children first, so the module's direct imports are the
+    # depth-1 rows between its own row and the previous top-level row
+    index = next(i for i, (depth, name, _, _) in enumerate(rows) if depth == 0 and name == module)
+    direct = []
+    for depth, name, _, cumulative in reversed(rows[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            direct.append((name, cumulative / 1000))
+    direct.sort(key=lambda item: -item[1])
+    return rows[index][3] / 1000, direct
+
+
+def import_times(modules=ENTRY_POINTS):
+    """{module: {'import_ms': ...}} for each module, or {'error': ...}"""
+    results = {}
+    for module in modules:
+        try:
+            total, _ = import_profile(module)
+            results[module] = {'import_ms': total}
+        except Exception as e:
+            results[module] = {'error': f"{type(e).__name__}: {e}"}
+    return results
+
+
+def model_load_ms():
+    """Time to load the shared model and face detector, in a fresh interpreter"""
+    code = ("import time; t = time.perf_counter(); import resources; "
+            "resources.registry.get('emotion_model'); resources.registry.get('face_detector'); "
+            "print((time.perf_counter() - t) * 1000)")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=600)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report import time of the FeelTune entry points")
+    parser.add_argument('modules', nargs='*', default=list(ENTRY_POINTS))
+    parser.add_argument('--top', type=int, default=5, help="heaviest direct imports to list per module")
+    parser.add_argument('--model', action='store_true', help="also time loading the model")
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        try:
+            total, direct = import_profile(module)
+        except Exception as e:
+            print(f"{module:32s} failed: {e}")
+            continue
+        print(f"{module:32s} {total:8.1f} ms")
+        for name, ms in direct[:args.top]:
+            print(f"    {name:28s} {ms:8.1f} ms")
+
+    if args.model:
+        print(f"{'model + face detector load':32s} {model_load_ms():8.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
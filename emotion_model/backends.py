@@ -0,0 +1,248 @@
+import json
+import os
+
+import numpy as np
+
+# Exported model files produced by emotion_model/export.py
+KERAS_FILES = ('emotion_model/fer.json', 'emotion_model/fer.h5')
+NUMPY_MODEL = 'emotion_model/fer_folded.npz'
+ONNX_MODEL = 'emotion_model/fer.onnx'
+TFLITE_MODEL = 'emotion_model/fer.tflite'
+
+# Order in which "auto" tries the backends
+AUTO_ORDER = ('onnx', 'tflite', 'numpy', 'keras')
+
+# Model variants written by emotion_model/compress.py; "float" is the
+# original network
+MODEL_VARIANTS = ('float', 'int8', 'pruned', 'pruned_int8')
+
+
+def model_path(backend, variant='float'):
+    """File a backend loads for a model variant, e.g. fer_int8.onnx"""
+    base = {'keras': KERAS_FILES[1], 'numpy': NUMPY_MODEL, 'onnx': ONNX_MODEL, 'tflite': TFLITE_MODEL}[backend]
+    if variant == 'float':
+        return base
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant: {variant}")
+    if backend == 'keras':
+        raise ValueError("The keras backend only runs the float model")
+    root, ext = os.path.splitext(base)
+    return f"{root}_{variant}{ext}"
+
+
+def model_from_keras_json(text):
+    """Build the Keras model described by fer.json
+
+    fer.json was saved by Keras 2.2.4, a format Keras 3 no longer reads, so
+    under Keras 3 the Sequential model is rebuilt layer by layer from its
+    config. Initializers, regularizers and constraints only matter for
+    training and are left out.
+    """
+    import keras
+
+    if int(keras.__version__.split('.')[0]) < 3:
+        from keras.models import model_from_json
+
+        return model_from_json(text)
+
+    config = json.loads(text)
+    if config.get('class_name') != 'Sequential':
+        raise ValueError(f"Expected a Sequential model, got {config.get('class_name')}")
+    layer_configs = config['config']
+    if isinstance(layer_configs, dict):
+        layer_configs = layer_configs['layers']
+
+    layers = []
+    input_shape = None
+    for layer in layer_configs:
+        options = {key: value for key, value in layer['config'].items()
+                   if not key.endswith(('_initializer', '_regularizer', '_constraint'))}
+        shape = options.pop('batch_input_shape', None)
+        if input_shape is None and shape:
+            input_shape = tuple(shape[1:])
+        layers.append(getattr(keras.layers, layer['class_name'])(**options))
+    if input_shape is None:
+        raise ValueError("fer.json does not give the input shape")
+    return keras.Sequential([keras.Input(shape=input_shape)] + layers)
+
+
+class KerasBackend:
+    """Full Keras model loaded from fer.json/fer.h5
+
+    Without `weights_path` the layers keep their initial weights.
+    """
+
+    name = 'keras'
+
+    def __init__(self, json_path=KERAS_FILES[0], weights_path=KERAS_FILES[1]):
+        with open(json_path, 'r') as f:
+            self.model = model_from_keras_json(f.read())
+        if weights_path:
+            self.model.load_weights(weights_path)
+
+    def predict(self, batch, verbose=0):
+        return np.asarray(self.model.predict(batch, verbose=verbose))
+
+
+class OnnxBackend:
+    """ONNX Runtime session over the exported fer.onnx"""
+
+    name = 'onnx'
+
+    def __init__(self, path=ONNX_MODEL):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch, verbose=0):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class TFLiteBackend:
+    """TFLite interpreter, preferring the standalone tflite_runtime package"""
+
+    name = 'tflite'
+
+    def __init__(self, path=TFLITE_MODEL):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=path)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+
+    def predict(self, batch, verbose=0):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if self._batch_size != len(batch):
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def _conv2d(x, kernel, bias, padding):
+    """3x3 stride-1 NHWC convolution as one tensordot over sliding windows"""
+    kh, kw = kernel.shape[:2]
+    if padding == 'same':
+        ph, pw = kh // 2, kw // 2
+        x = np.pad(x, ((0, 0), (ph, ph), (pw, pw), (0, 0)))
+    windows = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis=(1, 2))
+    # windows: (N, H, W, C, kh, kw); kernel: (kh, kw, C, out)
+    out = np.tensordot(windows, kernel, axes=([4, 5, 3], [0, 1, 2]))
+    out += bias
+    return out
+
+
+def _max_pool(x, size):
+    n, h, w, c = x.shape
+    ph, pw = size
+    h, w = h // ph, w // pw
+    x = x[:, :h * ph, :w * pw]
+    return x.reshape(n, h, ph, w, pw, c).max(axis=(2, 4))
+
+
+def _softmax(x):
+    x = x - x.max(axis=-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=-1, keepdims=True)
+    return x
+
+
+class NumpyBackend:
+    """Vectorized NumPy implementation of the folded FER network
+
+    Runs the graph written by export.py (BatchNorm folded into a per-channel
+    conv epilogue, Dropout removed) without importing TensorFlow.
+    """
+
+    name = 'numpy'
+
+    def __init__(self, path=NUMPY_MODEL):
+        with np.load(path) as data:
+            self.layers = json.loads(str(data['graph']))
+            params = {key: data[key] for key in data.files if key != 'graph'}
+        # int8 variants store each kernel with a per-output-channel scale
+        for key in [key for key in params if key.endswith('_qscale')]:
+            kernel = key[:-len('_qscale')]
+            params[kernel] = params[kernel].astype(np.float32) * params.pop(key)
+        self.params = {key: value.astype(np.float32) for key, value in params.items()}
+
+    def predict(self, batch, verbose=0):
+        x = np.asarray(batch, dtype=np.float32)
+        for index, layer in enumerate(self.layers):
+            kind = layer['type']
+            if kind == 'conv':
+                x = _conv2d(x, self.params[f'{index}_kernel'], self.params[f'{index}_bias'], layer['padding'])
+                if layer['activation'] == 'relu':
+                    np.maximum(x, 0, out=x)
+                if layer.get('affine'):
+                    x *= self.params[f'{index}_scale']
+                    x += self.params[f'{index}_shift']
+            elif kind == 'maxpool':
+                x = _max_pool(x, layer['pool_size'])
+            elif kind == 'flatten':
+                x = x.reshape(len(x), -1)
+            elif kind == 'dense':
+                x = x @ self.params[f'{index}_kernel'] + self.params[f'{index}_bias']
+                if layer['activation'] == 'relu':
+                    np.maximum(x, 0, out=x)
+                elif layer['activation'] == 'softmax':
+                    x = _softmax(x)
+        return x
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'onnx': OnnxBackend,
+    'tflite': TFLiteBackend,
+    'numpy': NumpyBackend,
+}
+
+_loaded = {}
+
+
+def _create(name, variant):
+    path = model_path(name, variant)
+    backend = KerasBackend() if name == 'keras' else BACKENDS[name](path)
+    backend.variant = variant
+    return backend
+
+
+def load_backend(name='auto', variant='float'):
+    """Load an inference backend by name, or the first usable one for "auto"
+
+    `variant` selects the float model or a compressed one (see
+    MODEL_VARIANTS). "auto" skips backends whose model file has not been
+    exported for that variant or whose runtime package is not installed.
+    """
+    if name != 'auto':
+        return _create(name, variant)
+
+    errors = []
+    for candidate in AUTO_ORDER:
+        if candidate == 'keras' and variant != 'float':
+            continue
+        if not os.path.exists(model_path(candidate, variant)):
+            continue
+        try:
+            return _create(candidate, variant)
+        except Exception as e:
+            errors.append(f"{candidate}: {e}")
+    raise RuntimeError(f"No usable inference backend found for the {variant} model. " + "; ".join(errors))
+
+
+def get_backend(name='auto', variant='float'):
+    """Return a process-wide cached backend instance"""
+    if (name, variant) not in _loaded:
+        _loaded[name, variant] = load_backend(name, variant)
+    return _loaded[name, variant]
@@ -0,0 +1,418 @@
+"""Headless emotion tagging of image directories and video files.
+
+    python -m emotion_model.batch captures/ clips/*.mp4 -o tags.jsonl --workers 4
+
+Decoding and face detection run on a process pool; the face crops come back
+to this process, where one inference loop classifies them in batches.
+Video frames that look the same as the last detected frame reuse its face
+boxes, and face crops that match a recent crop reuse its probabilities,
+both by perceptual hash. Results are appended to JSON Lines (or Parquet
+part files with --format parquet) as they complete. Re-running with the same output skips
+every frame that is already recorded, so an interrupted run resumes. Frames that cannot be
+read, or whose worker fails, are written as rows with an `error` and tried again on resume.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+import reporting
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+
+def iter_sources(paths):
+    """Yield image and video files from files, directories and glob patterns"""
+    for path in paths:
+        matches = sorted(glob.glob(path)) if any(c in path for c in '*?[') else [path]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, _, files in os.walk(match):
+                    for name in sorted(files):
+                        if name.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                            yield os.path.join(root, name)
+            elif match.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                yield match
+
+
+def iter_tasks(sources, done, chunk_size, frame_step):
+    """Split sources into work chunks, leaving out frames already recorded
+
+    A task is (kind, path, frames): images are grouped chunk_size per task,
+    videos are cut into runs of chunk_size sampled frames.
+    """
+    images = []
+    for path in sources:
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            if (path, 0) not in done:
+                images.append(path)
+                if len(images) == chunk_size:
+                    yield ('images', tuple(images), None)
+                    images = []
+            continue
+
+        total = frame_count(path)
+        if total <= 0:
+            reporting.warning(f"Skipping {path}: no readable frames")
+            continue
+        frames = [i for i in range(0, total, frame_step) if (path, i) not in done]
+        for start in range(0, len(frames), chunk_size):
+            yield ('video', path, tuple(frames[start:start + chunk_size]))
+
+    if images:
+        yield ('images', tuple(images), None)
+
+
+def frame_count(path):
+    """Number of frames in a video, counted by reading to the end when the container does not say"""
+    capture = cv2.VideoCapture(path)
+    try:
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total <= 0:
+            total = 0
+            while capture.grab():
+                total += 1
+    finally:
+        capture.release()
+    return total
+
+
+def error_records(task, error):
+    """Output rows for every frame of a task whose worker failed"""
+    kind, target, frames = task
+    keys = [(path, 0) for path in target] if kind == 'images' else [(target, frame) for frame in frames]
+    return [{'source': source, 'frame': frame, 'timestamp': None, 'faces': [], 'error': error,
+             'timing': {'detect_ms': None, 'inference_ms': None}} for source, frame in keys]
+
+
+def _crop(gray, boxes):
+    return [cv2.resize(gray[y:y+h, x:x+w], (48, 48)) for (x, y, w, h) in boxes]
+
+
+def _detect(gray, detector):
+    boxes = [(int(x), int(y), int(w), int(h)) for (x, y, w, h) in detector.detect(gray)]
+    return _crop(gray, boxes), boxes
+
+
+def decode_and_detect(task):
+    """Process-pool worker: decode frames and crop faces
+
+    Returns a list of (source, frame, timestamp, boxes, crops, seconds, error)
+    with crops as uint8 48x48 arrays and error None unless the frame could
+    not be read. Only OpenCV is used here, so worker
+    processes never import the model.
+    """
+    from emotion_model.face_detector import get_face_detector
+    from emotion_model.result_cache import default_threshold, dhash, hamming
+
+    detector = get_face_detector()
+    kind, target, frames = task
+    results = []
+
+    if kind == 'images':
+        for path in target:
+            started = time.perf_counter()
+            gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            crops, boxes = _detect(gray, detector) if gray is not None else ([], [])
+            error = None if gray is not None else "could not read image"
+            results.append((path, 0, None, boxes, crops, time.perf_counter() - started, error))
+        return results
+
+    capture = cv2.VideoCapture(target)
+    fps = capture.get(cv2.CAP_PROP_FPS) or None
+    position = None
+    threshold = default_threshold()
+    # Hash and boxes of the last frame the detector actually ran on; frames
+    # compare against it rather than their predecessor so slow drift still
+    # triggers a new detection
+    detected = None
+    for frame_index in frames:
+        started = time.perf_counter()
+        # Sequential grabs are much cheaper than seeking for nearby frames
+        if position is None or frame_index < position or frame_index - position > 30:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            position = frame_index
+        while position < frame_index:
+            capture.grab()
+            position += 1
+        ok, frame = capture.read()
+        position += 1
+        if not ok:
+            results.append((target, frame_index, None, [], [], time.perf_counter() - started,
+                            "could not read frame"))
+            continue
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        key = dhash(gray)
+        if detected is not None and hamming(detected[0], key) <= threshold:
+            boxes = detected[1]
+            crops = _crop(gray, boxes)
+        else:
+            crops, boxes = _detect(gray, detector)
+            detected = (key, boxes)
+        timestamp = frame_index / fps if fps else None
+        results.append((target, frame_index, timestamp, boxes, crops, time.perf_counter() - started, None))
+    capture.release()
+    return results
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        if self._file.tell():
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b'\n':
+                # An interrupted run left a partial last line; end it so the
+                # next record starts on a line of its own
+                self._file.write(b'\n')
+
+    @staticmethod
+    def completed(path):
+        done = set()
+        if not os.path.exists(path):
+            return done
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                # Failed frames are tried again on the next run
+                if not record.get('error'):
+                    done.add((record['source'], record['frame']))
+        return done
+
+    def write(self, records):
+        for record in records:
+            self._file.write((json.dumps(record) + '\n').encode('utf-8'))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Writes one Parquet part file per run into an output directory"""
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(path, exist_ok=True)
+        self._pa = pa
+        self._schema = pa.schema([
+            ('source', pa.string()), ('frame', pa.int64()), ('timestamp', pa.float64()),
+            ('faces', pa.string()), ('detect_ms', pa.float64()), ('inference_ms', pa.float64()),
+            ('error', pa.string()),
+        ])
+        part = f"part-{int(time.time() * 1000)}.parquet"
+        self._writer = pq.ParquetWriter(os.path.join(path, part), self._schema)
+
+    @staticmethod
+    def completed(path):
+        if not os.path.isdir(path):
+            return set()
+        import pyarrow.parquet as pq
+
+        done = set()
+        for part in glob.glob(os.path.join(path, '*.parquet')):
+            try:
+                table = pq.read_table(part)
+            except Exception:
+                # Part file of an interrupted run without a footer
+                continue
+            errors = table.column('error').to_pylist() if 'error' in table.column_names else [None] * len(table)
+            done.update(key for key, error in zip(zip(table.column('source').to_pylist(),
+                                                      table.column('frame').to_pylist()), errors)
+                        if not error)
+        return done
+
+    def write(self, records):
+        columns = {name: [] for name in self._schema.names}
+        for record in records:
+            columns['source'].append(record['source'])
+            columns['frame'].append(record['frame'])
+            columns['timestamp'].append(record['timestamp'])
+            columns['faces'].append(json.dumps(record['faces']))
+            columns['detect_ms'].append(record['timing']['detect_ms'])
+            columns['inference_ms'].append(record['timing']['inference_ms'])
+            columns['error'].append(record.get('error'))
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class InferenceBatcher:
+    """Collects face crops from finished tasks and classifies them in batches
+
+    Frames are written once `batch_size` crops are collected, or once
+    `max_frames` frames or `max_delay` seconds have built up, so frames
+    without faces do not pile up in memory unwritten. Crops that match one
+    in `cache` by perceptual hash are not sent to the model again.
+    """
+
+    def __init__(self, model, writer, batch_size=64, cache=None, max_frames=1024, max_delay=5.0):
+        from emotion_model.result_cache import ResultCache, default_threshold
+
+        self.model = model
+        self.writer = writer
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else ResultCache(1024, default_threshold(), name="batch")
+        self.max_frames = max_frames
+        self.max_delay = max_delay
+        self._frames = []
+        self._crops = 0
+        self._since = time.monotonic()
+        self.frames_written = 0
+        self.faces_classified = 0
+        self.faces_reused = 0
+        self.errors = 0
+
+    def add(self, results):
+        if not self._frames:
+            self._since = time.monotonic()
+        for result in results:
+            self._frames.append(result)
+            self._crops += len(result[4])
+        if (self._crops >= self.batch_size or len(self._frames) >= self.max_frames
+                or time.monotonic() - self._since >= self.max_delay):
+            self.flush()
+
+    def add_task(self, task, future):
+        """Add a finished worker future; a failed task becomes one error row per frame"""
+        try:
+            results = future.result()
+        except Exception as e:
+            records = error_records(task, f"{type(e).__name__}: {e}")
+            self.writer.write(records)
+            self.frames_written += len(records)
+            self.errors += len(records)
+            return
+        self.add(results)
+
+    def flush(self):
+        from emotion_model.emotion_utils import _face_result
+
+        if not self._frames:
+            return
+        from emotion_model.result_cache import dhash
+
+        crops = [crop for frame in self._frames for crop in frame[4]]
+        started = time.perf_counter()
+        keys = [dhash(crop) for crop in crops]
+        predictions = [None] * len(crops)
+        # First crop of each hash that is not cached; later crops with the
+        # same hash in this flush share its prediction
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in missing:
+                predictions[i] = self.cache.get(key)
+                if predictions[i] is None:
+                    missing[key] = i
+        if missing:
+            batch = np.stack([crops[i] for i in missing.values()]).astype(np.float32).reshape(-1, 48, 48, 1)
+            batch /= 255.0
+            for (key, i), p in zip(missing.items(), np.asarray(self.model.predict(batch, verbose=0))):
+                predictions[i] = p
+                self.cache.put(key, p)
+        for i, key in enumerate(keys):
+            if predictions[i] is None:
+                predictions[i] = predictions[missing[key]]
+        self.faces_reused += len(crops) - len(missing)
+        inference_ms = (time.perf_counter() - started) * 1000 / max(1, len(crops))
+
+        records = []
+        offset = 0
+        for source, frame, timestamp, boxes, frame_crops, seconds, error in self._frames:
+            faces = [_face_result(box, predictions[offset + i]) for i, box in enumerate(boxes)]
+            offset += len(frame_crops)
+            record = {
+                'source': source,
+                'frame': frame,
+                'timestamp': timestamp,
+                'faces': faces,
+                'timing': {'detect_ms': round(seconds * 1000, 3),
+                           'inference_ms': round(inference_ms * len(faces), 3)},
+            }
+            if error:
+                record['error'] = error
+                self.errors += 1
+            records.append(record)
+        self.writer.write(records)
+        self.frames_written += len(records)
+        self.faces_classified += len(crops)
+        self._frames = []
+        self._crops = 0
+
+
+def run(paths, output, model, workers=None, batch_size=64, chunk_size=16, frame_step=1,
+        output_format='jsonl', progress=None):
+    """Tag every frame under `paths` and append the results to `output`"""
+    writer_cls = ParquetWriter if output_format == 'parquet' else JsonlWriter
+    done = writer_cls.completed(output)
+    writer = writer_cls(output)
+    batcher = InferenceBatcher(model, writer, batch_size)
+
+    workers = workers or os.cpu_count() or 1
+    # At most this many chunks are decoded but not yet classified, which
+    # keeps memory flat no matter how large the input is
+    max_in_flight = workers * 2
+    tasks = iter_tasks(iter_sources(paths), done, chunk_size, frame_step)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = {}
+            for task in tasks:
+                while len(in_flight) >= max_in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        batcher.add_task(in_flight.pop(future), future)
+                in_flight[pool.submit(decode_and_detect, task)] = task
+            for future, task in in_flight.items():
+                batcher.add_task(task, future)
+        batcher.flush()
+    finally:
+        writer.close()
+    return batcher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tag faces in images and videos with emotions")
+    parser.add_argument('inputs', nargs='+', help="image/video files, directories or glob patterns")
+    parser.add_argument('-o', '--output', required=True, help="JSONL file, or directory for --format parquet")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+    parser.add_argument('--workers', type=int, default=None, help="decode/detect processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=64, help="face crops per forward pass")
+    parser.add_argument('--chunk-size', type=int, default=16, help="images or video frames per work item")
+    parser.add_argument('--frame-step', type=int, default=1, help="only tag every Nth video frame")
+    parser.add_argument('--backend', default=None, help="inference backend, see emotion_model.backends")
+    args = parser.parse_args(argv)
+
+    from emotion_model.emotion_utils import load_emotion_model
+
+    model = load_emotion_model(args.backend)
+    if model is None:
+        print("Could not load the emotion model", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    batcher = run(args.inputs, args.output, model, args.workers, args.batch_size, args.chunk_size,
+                  args.frame_step, args.format)
+    elapsed = time.perf_counter() - started
+    print(f"Tagged {batcher.frames_written} frames, {batcher.faces_classified} faces "
+          f"in {elapsed:.1f}s ({batcher.frames_written / max(elapsed, 1e-9):.1f} frames/s, "
+          f"{batcher.faces_reused} faces reused by hash, {batcher.errors} frames failed)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""Build compressed variants of the FER model.
+
+    python -m emotion_model.compress --variant int8 pruned pruned_int8 --format numpy onnx
+
+Starts from the folded graph of export.py (fer.h5 when present, otherwise
+fer_folded.npz) and writes e.g. fer_folded_int8.npz and fer_pruned.onnx next
+to the float models. Select one at runtime with FEELTUNE_MODEL_VARIANT and
+compare them with `python -m emotion_model.evaluate`.
+
+- pruned: structured pruning that removes the least important conv filters
+  and hidden dense units, so every layer gets smaller. There is no
+  fine-tuning step, so check the accuracy before shipping a high ratio.
+- int8: weights stored as int8 with one scale per output channel. ONNX
+  Runtime runs these with integer kernels; the NumPy backend dequantizes
+  at load time, so for it only the file gets smaller.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from emotion_model.backends import KERAS_FILES, NUMPY_MODEL, NumpyBackend, model_path
+
+COMPRESSED_VARIANTS = ('int8', 'pruned', 'pruned_int8')
+
+
+def load_folded(json_path=KERAS_FILES[0], weights_path=KERAS_FILES[1], numpy_path=NUMPY_MODEL):
+    """Return (graph, params, keras_model) of the float model; keras_model may be None"""
+    if os.path.exists(weights_path):
+        from emotion_model.backends import KerasBackend
+        from emotion_model.export import fold_model
+
+        reference = KerasBackend(json_path, weights_path)
+        graph, params = fold_model(reference.model)
+        return graph, params, reference.model
+    model = NumpyBackend(numpy_path)
+    return model.layers, dict(model.params), None
+
+
+def _consumer(graph, index):
+    """Index of the conv/dense layer reading the outputs of layer `index`, and whether a flatten is in between"""
+    flattened = False
+    for next_index in range(index + 1, len(graph)):
+        kind = graph[next_index]['type']
+        if kind == 'flatten':
+            flattened = True
+        elif kind in ('conv', 'dense'):
+            return next_index, flattened
+    return None, False
+
+
+def _input_weights(kernel, kind, flattened, channels):
+    """View the consumer's kernel as (..., channels, out) with the pruned axis second to last"""
+    if kind == 'conv':
+        return kernel
+    if flattened:
+        return kernel.reshape(-1, channels, kernel.shape[-1])
+    return kernel
+
+
+def prune_channels(graph, params, ratio=0.5):
+    """Remove the `ratio` least important outputs of every conv and hidden dense layer
+
+    A channel's importance is the L1 norm of its filter times that of the
+    weights reading it (times |scale| for a BatchNorm epilogue). When a
+    channel goes, the constant its BatchNorm shift fed forward is moved into
+    the next layer's bias. Returns new (graph, params); the inputs are not
+    modified.
+    """
+    params = {key: value.copy() for key, value in params.items()}
+    for index, layer in enumerate(graph):
+        if layer['type'] not in ('conv', 'dense'):
+            continue
+        consumer, flattened = _consumer(graph, index)
+        if consumer is None:
+            continue  # the output layer keeps all classes
+
+        kernel = params[f'{index}_kernel']
+        channels = kernel.shape[-1]
+        keep_count = max(1, int(round(channels * (1 - ratio))))
+        if keep_count >= channels:
+            continue
+
+        next_kernel = params[f'{consumer}_kernel']
+        next_shape = next_kernel.shape
+        reading = _input_weights(next_kernel, graph[consumer]['type'], flattened, channels)
+        scale = params.get(f'{index}_scale', np.ones(channels, np.float32))
+        shift = params.get(f'{index}_shift', np.zeros(channels, np.float32))
+
+        outgoing = np.abs(np.moveaxis(reading, -2, 0)).reshape(channels, -1).sum(axis=1)
+        incoming = np.abs(kernel).reshape(-1, channels).sum(axis=0)
+        importance = np.abs(scale) * incoming * outgoing
+        keep = np.sort(np.argsort(importance)[-keep_count:])
+        dropped = np.setdiff1d(np.arange(channels), keep)
+
+        # A dropped channel with a zero ReLU output still contributed its
+        # shift; fold that constant into the consumer's bias
+        dropped_weights = np.moveaxis(reading[..., dropped, :], -2, 0)
+        contribution = dropped_weights * shift[dropped].reshape(-1, *[1] * (reading.ndim - 1))
+        params[f'{consumer}_bias'] = params[f'{consumer}_bias'] + contribution.reshape(-1, next_shape[-1]).sum(axis=0)
+
+        params[f'{index}_kernel'] = kernel[..., keep]
+        params[f'{index}_bias'] = params[f'{index}_bias'][keep]
+        if f'{index}_scale' in params:
+            params[f'{index}_scale'] = scale[keep]
+            params[f'{index}_shift'] = shift[keep]
+
+        reading = reading[..., keep, :]
+        if graph[consumer]['type'] == 'dense' and flattened:
+            reading = reading.reshape(-1, next_shape[-1])
+        params[f'{consumer}_kernel'] = np.ascontiguousarray(reading)
+
+    return [dict(layer) for layer in graph], params
+
+
+def quantize_weights(params):
+    """Store every kernel as int8 with a symmetric per-output-channel `_qscale`"""
+    quantized = {}
+    for key, value in params.items():
+        if not key.endswith('_kernel'):
+            quantized[key] = value
+            continue
+        channels = value.shape[-1]
+        max_abs = np.abs(value).reshape(-1, channels).max(axis=0)
+        scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        quantized[key] = np.clip(np.round(value / scale), -127, 127).astype(np.int8)
+        quantized[f'{key}_qscale'] = scale
+    return quantized
+
+
+def save_numpy_variant(graph, params, variant):
+    from emotion_model.export import save_numpy
+
+    if variant.endswith('int8'):
+        params = quantize_weights(params)
+    return save_numpy(graph, params, model_path('numpy', variant))
+
+
+def save_onnx_variant(graph, params, variant):
+    """Write the float graph, then quantize its weights with ONNX Runtime for int8 variants"""
+    from emotion_model.export import save_onnx
+
+    path = model_path('onnx', variant)
+    if not variant.endswith('int8'):
+        return save_onnx(graph, params, path)
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    with tempfile.TemporaryDirectory() as tmp:
+        float_path = save_onnx(graph, params, os.path.join(tmp, 'fer_float.onnx'))
+        # One scale per output channel, like quantize_weights, so the two
+        # int8 variants are comparable in the accuracy report
+        quantize_dynamic(float_path, path, weight_type=QuantType.QInt8, per_channel=True)
+    return path
+
+
+def save_tflite_variant(keras_model, variant):
+    """Post-training weight quantization with the TFLite converter"""
+    if keras_model is None or variant != 'int8':
+        raise ValueError("TFLite variants are only built for int8, from the Keras model")
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    path = model_path('tflite', variant)
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    return path
+
+
+def parameter_count(params):
+    return int(sum(value.size for key, value in params.items() if not key.endswith('_qscale')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build pruned and int8 variants of the FER model")
+    parser.add_argument('--variant', nargs='+', choices=COMPRESSED_VARIANTS, default=list(COMPRESSED_VARIANTS))
+    parser.add_argument('--format', nargs='+', choices=['numpy', 'onnx', 'tflite'], default=['numpy', 'onnx'])
+    parser.add_argument('--prune-ratio', type=float, default=0.5,
+                        help="fraction of filters/units removed from each layer")
+    args = parser.parse_args(argv)
+
+    graph, params, keras_model = load_folded()
+    print(f"float: {parameter_count(params):,} parameters")
+    pruned = None
+
+    failed = False
+    for variant in args.variant:
+        variant_graph, variant_params = graph, params
+        if variant.startswith('pruned'):
+            if pruned is None:
+                pruned = prune_channels(graph, params, args.prune_ratio)
+                print(f"pruned: {parameter_count(pruned[1]):,} parameters")
+            variant_graph, variant_params = pruned
+
+        savers = {
+            'numpy': lambda: save_numpy_variant(variant_graph, variant_params, variant),
+            'onnx': lambda: save_onnx_variant(variant_graph, variant_params, variant),
+            'tflite': lambda: save_tflite_variant(keras_model, variant),
+        }
+        for fmt in args.format:
+            try:
+                path = savers[fmt]()
+            except ValueError as e:
+                print(f"Skipped {variant} {fmt}: {e}")
+                continue
+            except Exception as e:
+                failed = True
+                print(f"Failed {variant} {fmt}: {type(e).__name__}: {e}")
+                continue
+            print(f"Wrote {variant} {fmt}: {path} ({os.path.getsize(path) / 1024:.0f} KiB)")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,65 +1,226 @@
-import cv2
+import os
+
 import numpy as np
-import streamlit as st
-from keras.models import model_from_json
 
-def load_emotion_model():
-    """Load and return the emotion detection model"""
+import metrics
+import reporting
+from emotion_model.backends import get_backend, load_backend
+
+# OpenCV, the face detector and the inference runtimes are imported on
+# first use, so importing this module stays cheap for the app and CLIs
+
+def load_emotion_model(backend=None, variant=None):
+    """Load and return the emotion detection model
+
+    `backend` is one of "keras", "onnx", "tflite", "numpy" or "auto"
+    (default, overridable with FEELTUNE_BACKEND). "auto" prefers an exported
+    lightweight model and falls back to fer.json/fer.h5 via Keras.
+    `variant` picks a compressed model built by emotion_model.compress:
+    "float" (default, overridable with FEELTUNE_MODEL_VARIANT), "int8",
+    "pruned" or "pruned_int8".
+    """
     try:
-        # Load FER model
-        with open('emotion_model/fer.json', 'r') as f:
-            model = model_from_json(f.read())
-        
-        model.load_weights('emotion_model/fer.h5')
-        return model
+        backend = backend or os.getenv("FEELTUNE_BACKEND", "auto")
+        variant = variant or os.getenv("FEELTUNE_MODEL_VARIANT", "float")
+        return load_backend(backend, variant)
     except Exception as e:
-        st.error(f"Error loading emotion model: {e}")
+        reporting.error(f"Error loading emotion model: {e}")
         return None
 
-def detect_emotion(img, model=None, draw_box=False):
-    """Detect emotion from image"""
-    try:
-        emotion_labels = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
-        
-        if model is None:
-            return "neutral"  # Fallback if model not loaded
-            
-        # Convert to grayscale if image is RGB/BGR
-        if len(img.shape) == 3:
-            gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        else:
-            gray = img
-            
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.3, minNeighbors=5)
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+
+
+def _to_gray(img):
+    """Convert to grayscale if image is RGB/BGR"""
+    if len(img.shape) == 3:
+        import cv2
+
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return img
+
+
+def detect_faces_emotions(images, model=None, draw_box=False, detector=None, cache=None):
+    """Detect per-face emotions for one or more images with a single forward pass
+
+    Returns one list per input image; each entry is a dict with the face
+    `box` (x, y, w, h), its `label`, `confidence` and the full
+    `probabilities` vector ordered like EMOTION_LABELS. `detector` defaults
+    to the shared detector from get_face_detector(). With a ResultCache as
+    `cache`, faces whose crop matches an earlier one skip inference. With
+    `draw_box`, returns (results, annotated) where annotated holds a copy of
+    each image with its faces drawn; the input images are never modified.
+    """
+    if model is None:
+        results = [[] for _ in images]
+        return (results, [img.copy() for img in images]) if draw_box else results
+
+    if detector is None:
+        from emotion_model.face_detector import get_face_detector
+
+        detector = get_face_detector()
+
+    results = [[] for _ in images]
+
+    # Collect every face ROI from every frame into one batch
+    boxes = []
+    crops = []
+    for frame_index, img in enumerate(images):
+        gray = _to_gray(img)
+        with metrics.span("detect.cascade"):
+            found = detector.detect(gray)
+        metrics.observe("faces_per_frame", len(found), buckets=metrics.SIZE_BUCKETS)
+        for box in found:
+            crops.append((gray, box))
+            boxes.append((frame_index, box))
+
+    predictions = _classify_crops(crops, model, cache) if crops else []
+
+    for (frame_index, box), probabilities in zip(boxes, predictions):
+        results[frame_index].append(_face_result(box, probabilities))
+
+    if draw_box:
+        return results, [annotate_faces(img, faces) for img, faces in zip(images, results)]
+    return results
+
+
+def annotate_faces(img, faces):
+    """Return a copy of `img` with each face's box and label drawn on it"""
+    annotated = img.copy()
+    for face in faces:
+        _draw_face(annotated, face)
+    return annotated
+
+
+def _draw_face(img, face):
+    import cv2
+
+    x, y, w, h = face["box"]
+    cv2.rectangle(img, (x, y), (x+w, y+h), (255, 0, 0), 2)
+    label = f'{face["label"]} ({face["confidence"]*100:.1f}%)'
+    cv2.putText(img, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
-        emotions = []
 
-        for (x, y, w, h) in faces:
-            roi_gray = gray[y:y+h, x:x+w]
-            roi_resized = cv2.resize(roi_gray, (48, 48)) / 255.0
-            roi_reshaped = roi_resized.reshape(1, 48, 48, 1)
+def classify_faces(gray, boxes, model, cache=None):
+    """Classify already-located faces of one grayscale frame in a single batch
 
-            prediction = model.predict(roi_reshaped, verbose=0)
-            max_index = np.argmax(prediction[0])
-            emotion = emotion_labels[max_index]
-            confidence = float(np.max(prediction[0]))
+    With a ResultCache as `cache`, faces whose crop matches an earlier one
+    reuse its probabilities instead of being classified again.
+    """
+    if not len(boxes):
+        return []
+    boxes = [tuple(int(v) for v in box) for box in boxes]
+    probabilities = _classify_crops([(gray, box) for box in boxes], model, cache)
+    return [_face_result(box, p) for box, p in zip(boxes, probabilities)]
 
-            emotions.append((emotion, confidence))
 
-            if draw_box:
-                cv2.rectangle(img, (x, y), (x+w, y+h), (255, 0, 0), 2)
-                label = f'{emotion} ({confidence*100:.1f}%)'
-                cv2.putText(img, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+def _classify_crops(crops, model, cache=None):
+    """Probabilities of (gray, box) crops, reusing those of matching cached crops"""
+    if cache is None:
+        return _predict_crops(crops, model)
 
-        # Return most confident emotion or "neutral" if no face found
-        if emotions:
-            return max(emotions, key=lambda x: x[1])[0]
+    from emotion_model.result_cache import crop_keys, model_namespace
+
+    namespace = model_namespace(model)
+    keys = crop_keys(crops)
+    probabilities = [cache.get(key, namespace=namespace) for key in keys]
+    missing = [i for i, p in enumerate(probabilities) if p is None]
+    if missing:
+        predictions = _predict_crops([crops[i] for i in missing], model)
+        for i, prediction in zip(missing, predictions):
+            probabilities[i] = prediction.copy()
+            cache.put(keys[i], probabilities[i], namespace=namespace)
+    return probabilities
+
+
+def _crop_face(gray, box):
+    import cv2
+
+    x, y, w, h = box
+    return cv2.resize(gray[y:y+h, x:x+w], (48, 48))
+
+
+def _predict_crops(crops, model):
+    """Classify (gray, box) crops via this thread's preallocated input batch"""
+    from emotion_model.preprocess import get_batch_buffer
+
+    with metrics.span("detect.preprocess"):
+        batch = get_batch_buffer().fill(crops)
+    metrics.observe("inference_batch_size", len(batch), buckets=metrics.SIZE_BUCKETS)
+    with metrics.span("detect.predict"):
+        return np.asarray(model.predict(batch, verbose=0))
+
+
+def _face_result(box, probabilities):
+    max_index = int(np.argmax(probabilities))
+    return {
+        "box": tuple(int(v) for v in box),
+        "label": EMOTION_LABELS[max_index],
+        "confidence": float(probabilities[max_index]),
+        "probabilities": [float(p) for p in probabilities],
+    }
+
+
+def dominant_emotion(faces, default="sad"):
+    """Return the label of the most confident face, or the default if none"""
+    if not faces:
+        return default
+    return max(faces, key=lambda face: face["confidence"])["label"]
+
+
+def detect_emotion(img, model=None, draw_box=False, backend=None, detector=None, with_probabilities=False,
+                   cache=True):
+    """Detect emotion from image
+
+    Pass a loaded `model`, or a `backend` name to use a shared instance of
+    that inference backend. With `with_probabilities`, returns
+    (emotion, probabilities) where probabilities is the dominant face's
+    full vector, or None when no face was classified. With `draw_box`, a
+    copy of `img` with the faces drawn is appended to the return value;
+    `img` itself is left untouched. Faces are always
+    detected; those whose crop matches a recently classified one reuse its
+    probabilities from the shared result cache. Pass `cache=False` to always
+    run the model, or a ResultCache of your own.
+    """
+    with metrics.trace("detect_emotion"):
+        emotion, probabilities, annotated = _detect_emotion(img, model, draw_box, backend, detector, cache)
+    result = (emotion, probabilities) if with_probabilities else (emotion,)
+    if draw_box:
+        result += (annotated if annotated is not None else img.copy(),)
+    return result if len(result) > 1 else emotion
+
+
+def _detect_emotion(img, model, draw_box, backend, detector, cache):
+    try:
+        if cache is True:
+            from emotion_model.result_cache import get_result_cache
+
+            cache = get_result_cache()
+        elif cache is False:
+            cache = None
+
+        if model is None and backend is not None:
+            model = get_backend(backend)
+
+        if model is None:
+            return "neutral", None, None  # Fallback if model not loaded
+
+        annotated = None
+        if draw_box:
+            results, copies = detect_faces_emotions([img], model=model, draw_box=True, detector=detector,
+                                                    cache=cache)
+            faces, annotated = results[0], copies[0]
         else:
-            return "sad"
+            faces = detect_faces_emotions([img], model=model, detector=detector, cache=cache)[0]
+        if not faces:
+            return "sad", None, annotated
+
+        # Return most confident emotion or "sad" if no face found
+        dominant = max(faces, key=lambda face: face["confidence"])
+        return dominant["label"], dominant["probabilities"], annotated
     except Exception as e:
-        st.error(f"Error in emotion detection: {e}")
-        return "sad"
+        metrics.inc("errors_total", stage="detect_emotion", error=type(e).__name__)
+        reporting.error(f"Error in emotion detection: {e}")
+        return "sad", None, None
 
 def get_emotion_emoji(emotion):
     """Return emoji based on emotion"""
@@ -0,0 +1,190 @@
+"""Accuracy vs. latency report for the FER model variants.
+
+    python -m emotion_model.evaluate --data fer2013.csv [--usage PublicTest] [-o report.json]
+    python -m emotion_model.evaluate --data faces/     # one sub-folder per emotion label
+
+Every exported backend/variant pair found on disk (see emotion_model.compress)
+is run on the same labeled 48x48 faces. The report gives accuracy, agreement
+with the float model of the same backend (or another float model), latency
+at batch size 1, throughput at batch size 32 and the model file size. Without --data,
+random inputs are used and only agreement and speed are reported.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from emotion_model.backends import MODEL_VARIANTS, load_backend, model_path
+from emotion_model.emotion_utils import EMOTION_LABELS
+
+
+def load_fer_csv(path, usage=None, limit=None):
+    """Read FER2013-style rows (emotion, pixels, Usage) as (faces, labels)"""
+    faces, labels = [], []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if usage and row.get('Usage') != usage:
+                continue
+            faces.append(np.array(row['pixels'].split(), dtype=np.uint8).reshape(48, 48))
+            labels.append(int(row['emotion']))
+            if limit and len(faces) >= limit:
+                break
+    return faces, labels
+
+
+def load_folder(path, limit=None):
+    """Read images from <path>/<label>/ sub-folders named like EMOTION_LABELS"""
+    import cv2
+
+    faces, labels = [], []
+    for label_index, label in enumerate(EMOTION_LABELS):
+        folder = os.path.join(path, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            gray = cv2.imread(os.path.join(folder, name), cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                continue
+            faces.append(cv2.resize(gray, (48, 48), interpolation=cv2.INTER_AREA))
+            labels.append(label_index)
+    if limit:
+        faces, labels = faces[:limit], labels[:limit]
+    return faces, labels
+
+
+def load_dataset(path, usage=None, limit=None):
+    """Return (batch, labels) as the model sees them: float32 (N, 48, 48, 1) in [0, 1]"""
+    faces, labels = load_folder(path, limit) if os.path.isdir(path) else load_fer_csv(path, usage, limit)
+    if not faces:
+        raise ValueError(f"No labeled faces found in {path}")
+    batch = np.stack(faces).astype(np.float32)[..., None] / 255.0
+    return batch, np.array(labels)
+
+
+def predict_all(model, batch, batch_size=64):
+    return np.concatenate([np.asarray(model.predict(batch[i:i + batch_size], verbose=0))
+                           for i in range(0, len(batch), batch_size)])
+
+
+def measure_speed(model, batch, runs=50):
+    """p50/p95 latency of single-face predictions and faces/s at batch size 32"""
+    single = []
+    for i in range(runs + 2):
+        face = batch[i % len(batch)][None]
+        started = time.perf_counter()
+        model.predict(face, verbose=0)
+        single.append(time.perf_counter() - started)
+    single = np.array(single[2:]) * 1000
+
+    chunk = np.resize(batch, (32,) + batch.shape[1:])
+    model.predict(chunk, verbose=0)
+    started = time.perf_counter()
+    repeats = max(1, runs // 10)
+    for _ in range(repeats):
+        model.predict(chunk, verbose=0)
+    elapsed = time.perf_counter() - started
+    return {
+        'latency_p50_ms': float(np.percentile(single, 50)),
+        'latency_p95_ms': float(np.percentile(single, 95)),
+        'throughput_per_s': float(32 * repeats / elapsed),
+    }
+
+
+def evaluate(model, batch, labels=None, reference=None, runs=50):
+    """Quality and speed of one loaded model; `reference` holds the float model's probabilities"""
+    probabilities = predict_all(model, batch)
+    predicted = probabilities.argmax(axis=1)
+    report = {'accuracy': float(np.mean(predicted == labels)) if labels is not None else None}
+    if reference is not None:
+        report['agreement'] = float(np.mean(predicted == reference.argmax(axis=1)))
+        report['mean_abs_diff'] = float(np.mean(np.abs(probabilities - reference)))
+    report.update(measure_speed(model, batch, runs))
+    return report, probabilities
+
+
+def _file_size_kib(backend, variant):
+    path = model_path(backend, variant)
+    return os.path.getsize(path) / 1024 if os.path.exists(path) else None
+
+
+def compare_variants(batch, labels=None, backends=('numpy', 'onnx', 'tflite'), variants=MODEL_VARIANTS, runs=50):
+    """Evaluate every backend/variant pair whose model file exists; returns a list of report rows"""
+    rows = []
+    float_reference = None
+    for backend in backends:
+        # Compare with this backend's float model, or any float model if it has none
+        reference = float_reference
+        for variant in variants:
+            if not os.path.exists(model_path(backend, variant)):
+                continue
+            row = {'backend': backend, 'variant': variant, 'size_kib': _file_size_kib(backend, variant)}
+            try:
+                model = load_backend(backend, variant)
+                report, probabilities = evaluate(model, batch, labels, reference, runs)
+            except Exception as e:
+                row['error'] = f"{type(e).__name__}: {e}"
+                rows.append(row)
+                continue
+            if variant == 'float':
+                reference = probabilities
+                if float_reference is None:
+                    float_reference = probabilities
+            row.update(report)
+            rows.append(row)
+    return rows
+
+
+def _cell(value, fmt):
+    width = fmt.split('.')[0]
+    return format(value, fmt) if value is not None else format('-', '>' + width)
+
+
+def print_table(rows):
+    print(f"{'backend':8s} {'variant':12s} {'size KiB':>9s} {'accuracy':>9s} {'agree':>7s} "
+          f"{'p50 ms':>8s} {'p95 ms':>8s} {'faces/s':>9s}")
+    for row in rows:
+        if 'error' in row:
+            print(f"{row['backend']:8s} {row['variant']:12s} failed: {row['error']}")
+            continue
+        print(f"{row['backend']:8s} {row['variant']:12s} {_cell(row['size_kib'], '9.0f')} "
+              f"{_cell(row['accuracy'], '9.1%')} {_cell(row.get('agreement'), '7.1%')} "
+              f"{row['latency_p50_ms']:8.2f} {row['latency_p95_ms']:8.2f} {row['throughput_per_s']:9.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare accuracy and speed of the FER model variants")
+    parser.add_argument('--data', help="FER2013 CSV or a folder with one sub-folder per emotion label")
+    parser.add_argument('--usage', default=None, help="only CSV rows with this Usage, e.g. PublicTest")
+    parser.add_argument('--limit', type=int, default=None, help="evaluate at most this many faces")
+    parser.add_argument('--backend', nargs='+', default=['numpy', 'onnx', 'tflite'])
+    parser.add_argument('--variant', nargs='+', choices=MODEL_VARIANTS, default=list(MODEL_VARIANTS))
+    parser.add_argument('--runs', type=int, default=50, help="single-face predictions timed per model")
+    parser.add_argument('-o', '--output', help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.data:
+        batch, labels = load_dataset(args.data, args.usage, args.limit)
+    else:
+        batch = np.random.default_rng(0).random((args.limit or 256, 48, 48, 1), dtype=np.float32)
+        labels = None
+    print(f"Evaluating on {len(batch)} faces")
+
+    rows = compare_variants(batch, labels, args.backend, args.variant, args.runs)
+    if not rows:
+        print("No exported models found; run emotion_model.export and emotion_model.compress first")
+        return 1
+    print_table(rows)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'faces': len(batch), 'labeled': labels is not None, 'results': rows}, f, indent=2)
+        print(f"Saved {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""Export the Keras FER model to lightweight inference formats.
+
+    python -m emotion_model.export --format numpy onnx tflite --check
+
+The NumPy and ONNX exports share one folded graph: Dropout layers are
+dropped, and every BatchNormalization is folded into the convolution in
+front of it. Because the BatchNorm layers in fer.json sit after the ReLU,
+they become a per-channel scale/shift epilogue of that conv; a BatchNorm
+after a linear conv is folded straight into its kernel and bias.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from emotion_model.backends import (KERAS_FILES, NUMPY_MODEL, ONNX_MODEL, TFLITE_MODEL,
+                                    KerasBackend, load_backend)
+
+
+def fold_model(model):
+    """Return (graph, params) for a loaded Keras Sequential FER model"""
+    graph = []
+    params = {}
+
+    for layer in model.layers:
+        kind = type(layer).__name__
+        config = layer.get_config()
+        weights = layer.get_weights()
+
+        if kind == 'Dropout':
+            continue
+        elif kind == 'Conv2D':
+            if tuple(config['strides']) != (1, 1) or tuple(config.get('dilation_rate', (1, 1))) != (1, 1):
+                raise ValueError(f"Unsupported conv configuration in {layer.name}")
+            index = len(graph)
+            kernel = weights[0]
+            bias = weights[1] if len(weights) > 1 else np.zeros(kernel.shape[-1], np.float32)
+            params[f'{index}_kernel'] = kernel.astype(np.float32)
+            params[f'{index}_bias'] = bias.astype(np.float32)
+            graph.append({'type': 'conv', 'padding': config['padding'], 'activation': config['activation']})
+        elif kind == 'BatchNormalization':
+            gamma, beta, mean, variance = _batch_norm_weights(layer, config, weights)
+            scale = gamma / np.sqrt(variance + config['epsilon'])
+            shift = beta - mean * scale
+
+            if not graph or graph[-1]['type'] != 'conv' or graph[-1].get('affine'):
+                raise ValueError(f"Cannot fold {layer.name}: it does not follow a convolution")
+            index = len(graph) - 1
+            if graph[-1]['activation'] == 'linear':
+                params[f'{index}_kernel'] = params[f'{index}_kernel'] * scale
+                params[f'{index}_bias'] = params[f'{index}_bias'] * scale + shift
+            else:
+                params[f'{index}_scale'] = scale.astype(np.float32)
+                params[f'{index}_shift'] = shift.astype(np.float32)
+                graph[-1]['affine'] = True
+        elif kind == 'MaxPooling2D':
+            if tuple(config['strides']) != tuple(config['pool_size']) or config['padding'] != 'valid':
+                raise ValueError(f"Unsupported pooling configuration in {layer.name}")
+            graph.append({'type': 'maxpool', 'pool_size': list(config['pool_size'])})
+        elif kind == 'Flatten':
+            graph.append({'type': 'flatten'})
+        elif kind == 'Dense':
+            index = len(graph)
+            params[f'{index}_kernel'] = weights[0].astype(np.float32)
+            params[f'{index}_bias'] = weights[1].astype(np.float32)
+            graph.append({'type': 'dense', 'activation': config['activation']})
+        elif kind == 'InputLayer':
+            continue
+        else:
+            raise ValueError(f"Unsupported layer type: {kind}")
+
+    return graph, params
+
+
+def _batch_norm_weights(layer, config, weights):
+    """Split BatchNorm weights, filling in gamma/beta when scale/center are off"""
+    weights = list(weights)
+    channels = weights[-1].shape[0]
+    gamma = weights.pop(0) if config.get('scale', True) else np.ones(channels, np.float32)
+    beta = weights.pop(0) if config.get('center', True) else np.zeros(channels, np.float32)
+    mean, variance = weights
+    return gamma, beta, mean, variance
+
+
+def save_numpy(graph, params, path=NUMPY_MODEL):
+    np.savez_compressed(path, graph=np.array(json.dumps(graph)), **params)
+    return path
+
+
+def save_onnx(graph, params, path=ONNX_MODEL, input_size=48):
+    """Write the folded graph as an ONNX model (requires the onnx package)"""
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    nodes = []
+    initializers = []
+    counter = [0]
+
+    def name(prefix):
+        counter[0] += 1
+        return f'{prefix}_{counter[0]}'
+
+    def constant(prefix, value):
+        tensor_name = name(prefix)
+        initializers.append(numpy_helper.from_array(np.asarray(value, dtype=np.float32), tensor_name))
+        return tensor_name
+
+    # The app feeds NHWC batches; ONNX convolutions are NCHW
+    current = name('nchw')
+    nodes.append(helper.make_node('Transpose', ['input'], [current], perm=[0, 3, 1, 2]))
+
+    for index, layer in enumerate(graph):
+        kind = layer['type']
+        if kind == 'conv':
+            kernel = params[f'{index}_kernel']
+            weight = constant('W', kernel.transpose(3, 2, 0, 1))
+            bias = constant('B', params[f'{index}_bias'])
+            pad = kernel.shape[0] // 2 if layer['padding'] == 'same' else 0
+            output = name('conv')
+            nodes.append(helper.make_node('Conv', [current, weight, bias], [output],
+                                          kernel_shape=list(kernel.shape[:2]), pads=[pad] * 4))
+            current = output
+            if layer['activation'] == 'relu':
+                output = name('relu')
+                nodes.append(helper.make_node('Relu', [current], [output]))
+                current = output
+            if layer.get('affine'):
+                scale = constant('scale', params[f'{index}_scale'].reshape(1, -1, 1, 1))
+                shift = constant('shift', params[f'{index}_shift'].reshape(1, -1, 1, 1))
+                scaled, output = name('mul'), name('add')
+                nodes.append(helper.make_node('Mul', [current, scale], [scaled]))
+                nodes.append(helper.make_node('Add', [scaled, shift], [output]))
+                current = output
+        elif kind == 'maxpool':
+            output = name('pool')
+            nodes.append(helper.make_node('MaxPool', [current], [output],
+                                          kernel_shape=layer['pool_size'], strides=layer['pool_size']))
+            current = output
+        elif kind == 'flatten':
+            # Keras flattens channels-last, so go back to NHWC first
+            nhwc, output = name('nhwc'), name('flat')
+            nodes.append(helper.make_node('Transpose', [current], [nhwc], perm=[0, 2, 3, 1]))
+            nodes.append(helper.make_node('Flatten', [nhwc], [output], axis=1))
+            current = output
+        elif kind == 'dense':
+            weight = constant('W', params[f'{index}_kernel'])
+            bias = constant('B', params[f'{index}_bias'])
+            output = name('dense')
+            nodes.append(helper.make_node('Gemm', [current, weight, bias], [output]))
+            current = output
+            if layer['activation'] in ('relu', 'softmax'):
+                output = name(layer['activation'])
+                op = 'Relu' if layer['activation'] == 'relu' else 'Softmax'
+                nodes.append(helper.make_node(op, [current], [output]))
+                current = output
+
+    nodes[-1].output[0] = 'probabilities'
+    model = helper.make_model(
+        helper.make_graph(
+            nodes, 'fer',
+            [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['N', input_size, input_size, 1])],
+            [helper.make_tensor_value_info('probabilities', TensorProto.FLOAT, ['N', None])],
+            initializers,
+        ),
+        opset_imports=[helper.make_opsetid('', 13)],
+    )
+    # Pin the IR version so older onnxruntime releases can load the file
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def save_tflite(keras_model, path=TFLITE_MODEL):
+    """Convert with the TFLite converter, which folds BatchNorm and drops Dropout itself"""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    return path
+
+
+def check_parity(reference, candidate, batch=None, samples=32, seed=0):
+    """Compare a backend against the Keras reference on `batch`, or on seeded random 48x48 inputs"""
+    if batch is None:
+        batch = np.random.default_rng(seed).random((samples, 48, 48, 1), dtype=np.float32)
+    expected = np.asarray(reference.predict(batch, verbose=0))
+    actual = np.asarray(candidate.predict(batch, verbose=0))
+    return {
+        'max_abs_diff': float(np.max(np.abs(expected - actual))),
+        'label_agreement': float(np.mean(expected.argmax(axis=1) == actual.argmax(axis=1))),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the FER model to lightweight inference formats")
+    parser.add_argument('--format', nargs='+', choices=['numpy', 'onnx', 'tflite'], default=['numpy'])
+    parser.add_argument('--json', default=KERAS_FILES[0])
+    parser.add_argument('--weights', default=KERAS_FILES[1])
+    parser.add_argument('--check', action='store_true', help="compare each export with the Keras outputs")
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args(argv)
+
+    reference = KerasBackend(args.json, args.weights)
+    graph, params = fold_model(reference.model)
+
+    exporters = {
+        'numpy': lambda: save_numpy(graph, params),
+        'onnx': lambda: save_onnx(graph, params),
+        'tflite': lambda: save_tflite(reference.model),
+    }
+
+    failed = False
+    for fmt in args.format:
+        path = exporters[fmt]()
+        print(f"Exported {fmt}: {path}")
+        if args.check:
+            report = check_parity(reference, load_backend(fmt))
+            ok = report['max_abs_diff'] <= args.atol and report['label_agreement'] == 1.0
+            failed |= not ok
+            print(f"  parity {'ok' if ok else 'FAILED'}: max |diff| {report['max_abs_diff']:.2e}, "
+                  f"label agreement {report['label_agreement']:.1%}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# OpenCV's res10 SSD face detector; download both files into emotion_model/models/
+# https://github.com/opencv/opencv/tree/4.x/samples/dnn/face_detector
+DNN_PROTOTXT = 'emotion_model/models/deploy.prototxt'
+DNN_WEIGHTS = 'emotion_model/models/res10_300x300_ssd_iter_140000.caffemodel'
+
+
+def _downscale(gray, detect_width, min_ratio=0.0):
+    """Return (small_gray, ratio) with the frame shrunk to at most detect_width
+
+    The frame is never shrunk by more than `min_ratio`.
+    """
+    height, width = gray.shape[:2]
+    if not detect_width or width <= detect_width:
+        return gray, 1.0
+    ratio = max(detect_width / width, min_ratio)
+    if ratio >= 1.0:
+        return gray, 1.0
+    small_width = max(1, int(round(width * ratio)))
+    small = cv2.resize(gray, (small_width, max(1, int(round(height * ratio)))), interpolation=cv2.INTER_AREA)
+    return small, small_width / width
+
+
+def _clip_box(x, y, w, h, width, height):
+    x, y = max(0, int(x)), max(0, int(y))
+    w, h = min(int(w), width - x), min(int(h), height - y)
+    return x, y, w, h
+
+
+class HaarFaceDetector:
+    """Haar cascade detector that runs on a downscaled copy of the frame
+
+    Sizes are given in full-resolution pixels; boxes are returned in
+    full-resolution coordinates as (x, y, w, h) tuples.
+
+    By default `detect_width` wins over `min_size`: the cascade's smallest
+    window is 24 px, so after shrinking a frame to 480 px faces smaller
+    than about 24 * width / 480 px are not found (64 px at 1280 wide, 96 px
+    at 1920). With `keep_min_size`, `min_size` wins instead: the frame is
+    only shrunk as far as faces of `min_size` still cover that window,
+    which costs most of the speed-up for small `min_size` values.
+    `detect_width=None` always scans at full resolution.
+    """
+
+    name = 'haar'
+
+    def __init__(self, scale_factor=1.3, min_neighbors=5, min_size=(30, 30), max_size=None,
+                 detect_width=480, keep_min_size=False, cascade_path=None):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = tuple(min_size) if min_size else None
+        self.max_size = tuple(max_size) if max_size else None
+        self.detect_width = detect_width
+        self.keep_min_size = keep_min_size
+        self.cascade_path = cascade_path or cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        # CascadeClassifier is not safe to share between threads, so each
+        # thread builds its own once and reuses it
+        self._local = threading.local()
+
+    def _cascade(self):
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self.cascade_path)
+            if cascade.empty():
+                raise RuntimeError(f"Could not load Haar cascade from {self.cascade_path}")
+            self._local.cascade = cascade
+        return cascade
+
+    def _min_ratio(self):
+        """Smallest scale the frame may be shrunk to"""
+        if not self.keep_min_size:
+            return 0.0
+        if not self.min_size:
+            return 1.0
+        window = min(self._cascade().getOriginalWindowSize())
+        return window / min(self.min_size)
+
+    def detect(self, gray):
+        small, ratio = _downscale(gray, self.detect_width, self._min_ratio())
+
+        options = {}
+        if self.min_size:
+            options['minSize'] = tuple(max(1, int(s * ratio)) for s in self.min_size)
+        if self.max_size:
+            options['maxSize'] = tuple(max(1, int(s * ratio)) for s in self.max_size)
+
+        faces = self._cascade().detectMultiScale(small, scaleFactor=self.scale_factor,
+                                                 minNeighbors=self.min_neighbors, **options)
+
+        height, width = gray.shape[:2]
+        return [_clip_box(x / ratio, y / ratio, w / ratio, h / ratio, width, height) for (x, y, w, h) in faces]
+
+
+class DnnFaceDetector:
+    """OpenCV DNN (res10 SSD) face detector
+
+    The network always runs on a 300x300 blob, so it is insensitive to the
+    camera resolution and handles rotated or partially lit faces better than
+    the cascade.
+    """
+
+    name = 'dnn'
+
+    def __init__(self, prototxt=DNN_PROTOTXT, weights=DNN_WEIGHTS, confidence=0.5,
+                 min_size=(30, 30), max_size=None, input_size=300):
+        if not (os.path.exists(prototxt) and os.path.exists(weights)):
+            raise FileNotFoundError(f"DNN face detector files not found: {prototxt}, {weights}")
+        self.prototxt = prototxt
+        self.weights = weights
+        self.confidence = confidence
+        self.min_size = tuple(min_size) if min_size else None
+        self.max_size = tuple(max_size) if max_size else None
+        self.input_size = input_size
+        self._local = threading.local()
+
+    def _net(self):
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            net = cv2.dnn.readNetFromCaffe(self.prototxt, self.weights)
+            self._local.net = net
+        return net
+
+    def detect(self, gray):
+        height, width = gray.shape[:2]
+        bgr = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR) if gray.ndim == 2 else gray
+        blob = cv2.dnn.blobFromImage(cv2.resize(bgr, (self.input_size, self.input_size)), 1.0,
+                                     (self.input_size, self.input_size), (104.0, 177.0, 123.0))
+        net = self._net()
+        net.setInput(blob)
+        detections = net.forward()[0, 0]
+
+        faces = []
+        for detection in detections[detections[:, 2] >= self.confidence]:
+            x1, y1, x2, y2 = detection[3:7] * np.array([width, height, width, height])
+            box = _clip_box(x1, y1, x2 - x1, y2 - y1, width, height)
+            w, h = box[2], box[3]
+            if w <= 0 or h <= 0:
+                continue
+            if self.min_size and (w < self.min_size[0] or h < self.min_size[1]):
+                continue
+            if self.max_size and (w > self.max_size[0] or h > self.max_size[1]):
+                continue
+            faces.append(box)
+        return faces
+
+
+DETECTORS = {
+    'haar': HaarFaceDetector,
+    'dnn': DnnFaceDetector,
+}
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+def get_face_detector(kind=None, **options):
+    """Return a shared face detector, built once per (kind, options)
+
+    `kind` defaults to FEELTUNE_FACE_DETECTOR, or "haar".
+    """
+    kind = kind or os.getenv('FEELTUNE_FACE_DETECTOR', 'haar')
+    key = (kind, tuple(sorted(options.items())))
+    detector = _detectors.get(key)
+    if detector is None:
+        with _detectors_lock:
+            detector = _detectors.get(key)
+            if detector is None:
+                detector = DETECTORS[kind](**options)
+                _detectors[key] = detector
+    return detector
@@ -0,0 +1,224 @@
+"""Pipelined, multi-core face analysis for streams of frames.
+
+Each frame goes through four stages that overlap across frames:
+
+    decode -> detect + crop -> inference -> annotate (optional)
+
+Decoding, cascade detection and cropping run on a thread pool; OpenCV
+releases the GIL in all three, so they use every core. Crops from all
+frames in flight are classified by one inference thread in batches
+(MicroBatcher). Annotation draws on a copy of the frame, so the caller's
+image is never modified.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+
+
+class MicroBatcher:
+    """Collects face crops from concurrent requests into batched forward passes
+
+    The inference thread waits for a first crop, then keeps collecting for up
+    to `max_wait` seconds or until `max_batch` crops are queued, and runs the
+    model once for all of them. close() finishes the queued crops and stops
+    the thread.
+    """
+
+    def __init__(self, model, max_batch=64, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.crops = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, crops):
+        """Queue a list of 48x48 uint8 crops; the future resolves to their probabilities"""
+        future = Future()
+        if not len(crops):
+            future.set_result(np.empty((0, 7), dtype=np.float32))
+            return future
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((crops, future))
+        return future
+
+    def close(self):
+        """Classify the crops already queued, then stop the inference thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # None wakes the thread and tells it to exit once the queue is drained
+            self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending = [item]
+            count = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                pending.append(item)
+                count += len(item[0])
+
+            try:
+                batch = np.stack([crop for crops, _ in pending for crop in crops]).astype(np.float32)
+                batch = batch.reshape(-1, 48, 48, 1) / 255.0
+                with metrics.span("detect.predict"):
+                    predictions = np.asarray(self.model.predict(batch, verbose=0))
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.crops += count
+            metrics.observe("inference_batch_size", count, buckets=metrics.SIZE_BUCKETS)
+            offset = 0
+            for crops, future in pending:
+                future.set_result(predictions[offset:offset + len(crops)])
+                offset += len(crops)
+
+
+class FacePipeline:
+    """Overlaps decoding, detection, cropping and inference across frames
+
+    submit() takes encoded image bytes or a decoded (gray or RGB) array and
+    returns a Future for {"faces": [...], "annotated": image or None}, where
+    faces are the dicts of emotion_utils.detect_faces_emotions(). With
+    `annotate`, "annotated" is a copy of the frame with the boxes drawn.
+    At most `max_in_flight` frames are queued at once; submit() blocks
+    beyond that, which keeps memory flat when frames arrive faster than
+    they are processed.
+    """
+
+    def __init__(self, model, detector=None, workers=None, max_batch=64, max_wait=0.002,
+                 max_in_flight=None):
+        if detector is None:
+            from emotion_model.face_detector import get_face_detector
+
+            detector = get_face_detector()
+        self.model = model
+        self.detector = detector
+        self.workers = workers or os.cpu_count() or 1
+        self.batcher = MicroBatcher(model, max_batch, max_wait)
+        self.frames = 0
+        self.max_in_flight = max_in_flight or self.workers * 4
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="face-pipeline")
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+
+    def submit(self, frame, annotate=False):
+        self._slots.acquire()
+        result = Future()
+        result.add_done_callback(lambda _: self._slots.release())
+        try:
+            self._pool.submit(self._detect, frame, annotate, result)
+        except Exception:
+            result.cancel()
+            raise
+        return result
+
+    def map(self, frames, annotate=False):
+        """Yield the result of every frame, in input order, while later frames are processed"""
+        pending = []
+        for frame in frames:
+            pending.append(self.submit(frame, annotate))
+            while pending and pending[0].done():
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+    def _detect(self, frame, annotate, result):
+        """Pool stage: decode, detect and crop, then hand the crops to the inference thread"""
+        from emotion_model.emotion_utils import _crop_face, _to_gray
+
+        try:
+            if isinstance(frame, (bytes, bytearray, memoryview)):
+                from emotion_model.preprocess import decode_gray
+
+                with metrics.span("detect.decode"):
+                    frame = decode_gray(frame)
+            gray = _to_gray(frame)
+            with metrics.span("detect.cascade"):
+                boxes = [tuple(int(v) for v in box) for box in self.detector.detect(gray)]
+            metrics.observe("faces_per_frame", len(boxes), buckets=metrics.SIZE_BUCKETS)
+            with metrics.span("detect.preprocess"):
+                crops = [_crop_face(gray, box) for box in boxes]
+        except Exception as e:
+            result.set_exception(e)
+            return
+
+        # The pool thread moves on to the next frame; the inference thread
+        # finishes this one when its batch completes
+        self.batcher.submit(crops).add_done_callback(
+            lambda predictions: self._classified(frame, boxes, predictions, annotate, result))
+
+    def _classified(self, frame, boxes, predictions, annotate, result):
+        from emotion_model.emotion_utils import _face_result
+
+        try:
+            faces = [_face_result(box, p) for box, p in zip(boxes, predictions.result())]
+        except Exception as e:
+            result.set_exception(e)
+            return
+        self.frames += 1
+        if not annotate:
+            result.set_result({"faces": faces, "annotated": None})
+            return
+        # Drawing is left to the pool so the inference thread is not held up
+        try:
+            self._pool.submit(self._annotate, frame, faces, result)
+        except RuntimeError as e:
+            result.set_exception(e)
+
+    def _annotate(self, frame, faces, result):
+        from emotion_model.emotion_utils import annotate_faces
+
+        try:
+            with metrics.span("detect.annotate"):
+                annotated = annotate_faces(frame, faces)
+        except Exception as e:
+            result.set_exception(e)
+            return
+        result.set_result({"faces": faces, "annotated": annotated})
+
+    def close(self):
+        """Wait for the frames in flight, then stop the worker threads"""
+        for _ in range(self.max_in_flight):
+            self._slots.acquire()
+        self._pool.shutdown(wait=True)
+        self.batcher.close()
+        for _ in range(self.max_in_flight):
+            self._slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
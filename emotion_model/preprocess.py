@@ -0,0 +1,95 @@
+import io
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale, which costs a
+# fraction of a full decode
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def _as_buffer(data):
+    """Wrap bytes, a file-like object or an upload without copying the payload"""
+    if hasattr(data, 'getbuffer'):
+        data = data.getbuffer()
+    elif hasattr(data, 'read'):
+        data = data.read()
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def choose_reduction(data, min_width=640):
+    """Largest decode reduction that keeps the frame at least min_width wide
+
+    Only the image header is parsed. Faces wider than 48 * reduction pixels
+    still give the model full-resolution crops.
+    """
+    try:
+        # BytesIO shares the bytes object's buffer instead of copying it
+        width, _ = Image.open(data if hasattr(data, 'read') else io.BytesIO(data)).size
+    except Exception:
+        return 1
+    finally:
+        if hasattr(data, 'seek'):
+            data.seek(0)
+    reduction = 1
+    while reduction < 8 and width // (reduction * 2) >= min_width:
+        reduction *= 2
+    return reduction
+
+
+def decode_gray(data, reduction=1):
+    """Decode an encoded image straight to an 8-bit grayscale array
+
+    Skips the RGB intermediate of Image.open + np.array + cvtColor. With
+    `reduction` 2, 4 or 8, JPEGs are decoded at that fraction of their size.
+    `reduction="auto"` picks it with choose_reduction().
+    """
+    if reduction == 'auto':
+        reduction = choose_reduction(data)
+    gray = cv2.imdecode(_as_buffer(data), _REDUCED_FLAGS[reduction])
+    if gray is None:
+        raise ValueError("Could not decode image")
+    return gray
+
+
+class FaceBatchBuffer:
+    """Preallocated float32 model input that face crops are written into
+
+    fill() resizes each crop into a reused uint8 scratch tile and scales it
+    into the batch in place, so no per-face arrays are allocated. The view
+    it returns is overwritten by the next fill() on the same buffer.
+    """
+
+    def __init__(self, capacity=16, size=48):
+        self.size = size
+        self._scratch = np.empty((size, size), dtype=np.uint8)
+        self._batch = np.empty((capacity, size, size, 1), dtype=np.float32)
+
+    def fill(self, items):
+        """Write (gray, (x, y, w, h)) crops into the batch; returns the filled view"""
+        items = list(items)
+        if len(items) > len(self._batch):
+            self._batch = np.empty((max(len(items), 2 * len(self._batch)), self.size, self.size, 1),
+                                   dtype=np.float32)
+        for i, (gray, (x, y, w, h)) in enumerate(items):
+            cv2.resize(gray[y:y+h, x:x+w], (self.size, self.size), dst=self._scratch)
+            np.multiply(self._scratch, np.float32(1 / 255.0), out=self._batch[i, :, :, 0])
+        return self._batch[:len(items)]
+
+
+_local = threading.local()
+
+
+def get_batch_buffer():
+    """Return this thread's reusable FaceBatchBuffer"""
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.buffer = FaceBatchBuffer()
+    return buffer
@@ -0,0 +1,146 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import metrics
+
+# dHash grid size: a hash has HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+# Hashes this many bits apart or less count as the same picture
+DEFAULT_THRESHOLD = 6
+
+
+def dhash(gray, hash_size=HASH_SIZE):
+    """Difference hash of a grayscale image or face crop, as an int
+
+    The image is shrunk to (hash_size + 1) x hash_size and each bit says
+    whether a pixel is brighter than its left neighbour, so the hash
+    survives small shifts, noise, exposure changes and re-encoding.
+    """
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def crop_keys(crops):
+    """dHash of each (gray, box) face crop"""
+    keys = []
+    with metrics.span("detect.hash"):
+        for gray, box in crops:
+            x, y, w, h = (int(v) for v in box)
+            keys.append(dhash(gray[y:y+h, x:x+w]))
+    return keys
+
+
+_namespace_ids = itertools.count()
+
+
+def model_namespace(model):
+    """Cache namespace of a loaded model
+
+    Unlike id(model), it is never handed to another model after this one is
+    freed, so a reloaded model cannot pick up the old one's results.
+    """
+    namespace = getattr(model, '_result_cache_namespace', None)
+    if namespace is None:
+        namespace = next(_namespace_ids)
+        model._result_cache_namespace = namespace
+    return namespace
+
+
+class ResultCache:
+    """Bounded LRU cache of results keyed by perceptual hash
+
+    get() returns the value stored under the closest hash within
+    `threshold` bits. `namespace` keeps results apart that must not be
+    shared, such as those of different models.
+    """
+
+    def __init__(self, max_entries=256, threshold=DEFAULT_THRESHOLD, name="face"):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, namespace=None):
+        with self._lock:
+            entry_key = (namespace, key)
+            if entry_key not in self._entries and self.threshold > 0:
+                best = self.threshold + 1
+                for candidate in reversed(self._entries):
+                    if candidate[0] != namespace:
+                        continue
+                    distance = hamming(candidate[1], key)
+                    if distance < best:
+                        entry_key, best = candidate, distance
+                        if distance <= 1:
+                            break
+
+            value = self._entries.get(entry_key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(entry_key)
+        metrics.inc("result_cache_requests_total", cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def put(self, key, value, namespace=None):
+        with self._lock:
+            self._entries[(namespace, key)] = value
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def default_threshold():
+    return int(os.getenv("FEELTUNE_RESULT_CACHE_THRESHOLD", DEFAULT_THRESHOLD))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide face result cache, or None when disabled
+
+    It maps face crop hashes to probabilities. FEELTUNE_RESULT_CACHE_SIZE
+    sets the number of faces kept (default 256, 0 disables) and
+    FEELTUNE_RESULT_CACHE_THRESHOLD the largest hash distance treated as a
+    repeat of the same face.
+    """
+    global _cache
+    size = int(os.getenv("FEELTUNE_RESULT_CACHE_SIZE", "256"))
+    if size <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(size, default_threshold(), name="face")
+    return _cache
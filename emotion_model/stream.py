@@ -0,0 +1,255 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+import reporting
+from emotion_model.emotion_utils import EMOTION_LABELS, _to_gray, classify_faces
+from emotion_model.face_detector import get_face_detector
+from emotion_model.result_cache import ResultCache, default_threshold
+
+
+class EmotionSmoother:
+    """Exponential moving average over emotion probability vectors
+
+    The smoothed mood only changes once a new label has led the average for
+    `stable_frames` consecutive updates, so a single odd frame never
+    triggers new recommendations.
+    """
+
+    def __init__(self, alpha=0.3, stable_frames=5, min_confidence=0.35):
+        self.alpha = alpha
+        self.stable_frames = stable_frames
+        self.min_confidence = min_confidence
+        self.probabilities = None
+        self.mood = None
+        self._candidate = None
+        self._candidate_count = 0
+
+    def update(self, probabilities):
+        """Fold in one probability vector; return True when the mood changed"""
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        if self.probabilities is None:
+            self.probabilities = probabilities.copy()
+        else:
+            self.probabilities += self.alpha * (probabilities - self.probabilities)
+
+        index = int(np.argmax(self.probabilities))
+        label = EMOTION_LABELS[index]
+        if label == self.mood or self.probabilities[index] < self.min_confidence:
+            self._candidate, self._candidate_count = None, 0
+            return False
+
+        if label == self._candidate:
+            self._candidate_count += 1
+        else:
+            self._candidate, self._candidate_count = label, 1
+
+        if self._candidate_count >= self.stable_frames:
+            self.mood = label
+            self._candidate, self._candidate_count = None, 0
+            return True
+        return False
+
+    def reset(self):
+        self.probabilities = None
+        self.mood = None
+        self._candidate, self._candidate_count = None, 0
+
+
+class FaceTracker:
+    """Follows faces between full detections with template matching
+
+    Each face keeps a small template; on the next frame it is searched for
+    in a window around its previous box on a downscaled copy of the frame.
+    A face whose match score drops below `min_score` is lost, which makes
+    the stream run a full detection on the next frame.
+    """
+
+    def __init__(self, track_width=320, search_margin=0.5, min_score=0.5):
+        self.track_width = track_width
+        self.search_margin = search_margin
+        self.min_score = min_score
+        self.boxes = []
+        self._templates = []
+
+    def _small(self, gray):
+        height, width = gray.shape[:2]
+        ratio = min(1.0, self.track_width / width)
+        if ratio == 1.0:
+            return gray, ratio
+        return cv2.resize(gray, (self.track_width, max(1, int(height * ratio))), interpolation=cv2.INTER_AREA), ratio
+
+    def reset(self, gray, boxes):
+        """Start tracking a fresh set of detected boxes"""
+        small, ratio = self._small(gray)
+        self.boxes = []
+        self._templates = []
+        for (x, y, w, h) in boxes:
+            sx, sy, sw, sh = (int(v * ratio) for v in (x, y, w, h))
+            template = small[sy:sy + sh, sx:sx + sw]
+            if template.shape[0] < 4 or template.shape[1] < 4:
+                continue
+            self.boxes.append((int(x), int(y), int(w), int(h)))
+            self._templates.append(template.copy())
+
+    def track(self, gray):
+        """Update every box on a new frame; return the boxes still tracked"""
+        small, ratio = self._small(gray)
+        sheight, swidth = small.shape[:2]
+        boxes, templates = [], []
+
+        for (x, y, w, h), template in zip(self.boxes, self._templates):
+            th, tw = template.shape[:2]
+            margin_x, margin_y = int(tw * self.search_margin), int(th * self.search_margin)
+            sx, sy = int(x * ratio), int(y * ratio)
+            x0, y0 = max(0, sx - margin_x), max(0, sy - margin_y)
+            x1, y1 = min(swidth, sx + tw + margin_x), min(sheight, sy + th + margin_y)
+            window = small[y0:y1, x0:x1]
+            if window.shape[0] < th or window.shape[1] < tw:
+                continue
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (mx, my) = cv2.minMaxLoc(scores)
+            if score < self.min_score:
+                continue
+
+            nx, ny = x0 + mx, y0 + my
+            boxes.append((int(nx / ratio), int(ny / ratio), w, h))
+            templates.append(small[ny:ny + th, nx:nx + tw].copy())
+
+        self.boxes, self._templates = boxes, templates
+        return list(boxes)
+
+
+class EmotionStream:
+    """Continuous emotion detection over a stream of video frames
+
+    Frames are handed over with submit() from the capture thread and
+    processed by a worker thread at no more than `target_fps`. Only the
+    newest frame is kept: when inference falls behind, older frames are
+    dropped rather than queued. A full face detection runs every
+    `detect_every` processed frames; in between, faces are tracked.
+    `on_mood_change(mood)` is called from the worker thread whenever the
+    smoothed mood changes. Face crops that look the same as a recent one
+    reuse its probabilities from `cache` instead of running the model.
+    A frame that fails is counted in errors_total, and `last_error` holds
+    the message until a frame succeeds again.
+    """
+
+    def __init__(self, model, detector=None, target_fps=8, detect_every=5,
+                 smoother=None, tracker=None, on_mood_change=None, cache=None):
+        self.model = model
+        self.detector = detector or get_face_detector()
+        self.target_fps = target_fps
+        self.detect_every = detect_every
+        self.smoother = smoother or EmotionSmoother()
+        self.tracker = tracker or FaceTracker()
+        self.on_mood_change = on_mood_change
+        self.cache = cache if cache is not None else ResultCache(max_entries=32, threshold=default_threshold(), name="stream")
+
+        self.faces = []
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.fps = 0.0
+        self.last_error = None
+
+        self._since_detection = None
+        self._latest = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    @property
+    def mood(self):
+        return self.smoother.mood
+
+    @property
+    def probabilities(self):
+        return self.smoother.probabilities
+
+    def process(self, frame):
+        """Run detection/tracking and classification on one frame synchronously"""
+        gray = _to_gray(frame)
+
+        if self._since_detection is None or self._since_detection >= self.detect_every or not self.tracker.boxes:
+            boxes = self.detector.detect(gray)
+            self.tracker.reset(gray, boxes)
+            self._since_detection = 0
+        else:
+            boxes = self.tracker.track(gray)
+            self._since_detection += 1
+            if not boxes:
+                # Lost every face: detect again right away on the next frame
+                self._since_detection = None
+
+        self.faces = classify_faces(gray, boxes, self.model, self.cache)
+        self.frames_processed += 1
+
+        if self.faces:
+            dominant = max(self.faces, key=lambda face: face["confidence"])
+            if self.smoother.update(dominant["probabilities"]) and self.on_mood_change:
+                self.on_mood_change(self.smoother.mood)
+        return self.faces
+
+    def submit(self, frame):
+        """Hand a frame to the worker; never blocks the capture thread"""
+        with self._condition:
+            if self._latest is not None:
+                self.frames_dropped += 1
+            self._latest = frame
+            self._condition.notify()
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="emotion-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _run(self):
+        interval = 1.0 / self.target_fps if self.target_fps else 0.0
+        last = 0.0
+        while True:
+            with self._condition:
+                while self._running and self._latest is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                # Pace to the target rate; frames arriving meanwhile replace
+                # the pending one and count as dropped
+                wait = last + interval - time.monotonic()
+                while self._running and wait > 0:
+                    self._condition.wait(wait)
+                    wait = last + interval - time.monotonic()
+                if not self._running:
+                    return
+                frame, self._latest = self._latest, None
+
+            started = time.monotonic()
+            try:
+                self.process(frame)
+                self.last_error = None
+            except Exception as e:
+                self._since_detection = None
+                metrics.inc("errors_total", stage="stream", error=type(e).__name__)
+                message = f"Error in live emotion detection: {e}"
+                # Report a failure once, not for every frame it repeats on
+                if message != self.last_error:
+                    self.last_error = message
+                    reporting.error(message)
+            now = time.monotonic()
+            if last:
+                self.fps += 0.2 * (1.0 / max(now - last, 1e-6) - self.fps)
+            last = started
@@ -0,0 +1,289 @@
+"""Per-stage timings and counters for the detection and recommendation pipeline.
+
+Disabled by default. Set FEELTUNE_METRICS=1 (or call enable()) to record:
+
+    with metrics.trace("snapshot"):          # one request breakdown
+        with metrics.span("detect.cascade"):  # one timed stage
+            ...
+    metrics.inc("recommendations_total", path="pool")
+    metrics.observe("faces_per_frame", 2, buckets=SIZE_BUCKETS)
+
+While disabled, span() and trace() return a shared no-op context manager
+and inc()/observe() return after one flag check.
+
+Export: render_prometheus() gives the Prometheus text format, served by
+start_http_server() (FEELTUNE_METRICS_PORT) and service.py's GET /metrics;
+start_log_reporter() (FEELTUNE_METRICS_LOG_INTERVAL) logs a summary line
+per stage every N seconds. recent_traces() returns the last request
+breakdowns for the app's debug panel.
+"""
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+_NULL = contextlib.nullcontext()
+_current_trace = contextvars.ContextVar("feeltune_trace", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Thread-safe counters, histograms and a ring buffer of recent traces"""
+
+    def __init__(self, enabled=False, max_traces=50):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._traces = deque(maxlen=max_traces)
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._traces.clear()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def span(self, stage):
+        """Time a pipeline stage and add it to the active trace, if any"""
+        if not self.enabled:
+            return _NULL
+        return self._span(stage)
+
+    @contextlib.contextmanager
+    def _span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.inc("errors_total", stage=stage, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("stage_seconds", elapsed, stage=stage)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace["stages"].append((stage, round(elapsed * 1000, 3)))
+
+    def timed(self, stage, fn):
+        """Wrap a zero-argument callable so each call runs inside span(stage)"""
+        def call():
+            with self.span(stage):
+                return fn()
+        return call
+
+    def trace(self, name):
+        """Record a request breakdown of every span run inside it
+
+        Nested traces become spans of the outer one. Work handed to
+        recommender.fetch threads carries the trace along.
+        """
+        if not self.enabled:
+            return _NULL
+        if _current_trace.get() is not None:
+            return self._span(name)
+        return self._trace(name)
+
+    @contextlib.contextmanager
+    def _trace(self, name):
+        trace = {"name": name, "started": time.time(), "total_ms": None, "error": None, "stages": []}
+        token = _current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            yield trace
+        except Exception as e:
+            trace["error"] = f"{type(e).__name__}: {e}"
+            self.inc("errors_total", stage=name, error=type(e).__name__)
+            raise
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - started
+            trace["total_ms"] = round(elapsed * 1000, 3)
+            self.observe("request_seconds", elapsed, request=name)
+            with self._lock:
+                self._traces.append(trace)
+
+    def recent_traces(self, n=None):
+        """Most recent request breakdowns, newest first"""
+        with self._lock:
+            traces = list(self._traces)
+        traces.reverse()
+        return traces[:n] if n else traces
+
+    def snapshot(self):
+        """Copy of (counters, histograms) keyed by (name, labels)"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.buckets, list(h.counts), h.count, h.sum) for key, h in self._histograms.items()}
+        return counters, histograms
+
+    def render_prometheus(self, prefix="feeltune_"):
+        """Render every metric in the Prometheus text exposition format"""
+        counters, histograms = self.snapshot()
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(prefix + name, "counter")
+            lines.append(f"{prefix}{name}{_labels(labels)} {value}")
+
+        for (name, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+            full = prefix + name
+            header(full, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{full}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{full}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{full}_sum{_labels(labels)} {total}")
+            lines.append(f"{full}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """One human-readable line per histogram, for periodic logging"""
+        _, histograms = self.snapshot()
+        lines = []
+        for (name, labels), (_, _, count, total) in sorted(histograms.items()):
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            mean = total / count if count else 0.0
+            if name.endswith("_seconds"):
+                lines.append(f"{name}[{label}] count={count} mean={mean * 1000:.2f}ms")
+            else:
+                lines.append(f"{name}[{label}] count={count} mean={mean:.2f}")
+        return lines
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+registry = MetricsRegistry(enabled=os.getenv("FEELTUNE_METRICS", "0").lower() in ("1", "true", "yes"))
+
+enable = registry.enable
+inc = registry.inc
+observe = registry.observe
+span = registry.span
+timed = registry.timed
+trace = registry.trace
+recent_traces = registry.recent_traces
+render_prometheus = registry.render_prometheus
+
+
+def is_enabled():
+    return registry.enabled
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Serve GET /metrics on a daemon thread and return the server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_log_reporter(interval=60.0):
+    """Log summary_lines() every `interval` seconds on a daemon thread"""
+    def report():
+        while True:
+            time.sleep(interval)
+            for line in registry.summary_lines():
+                logger.info(line)
+
+    thread = threading.Thread(target=report, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters():
+    """Start the exporters configured in the environment, once per process"""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started or not registry.enabled:
+            return
+        _exporters_started = True
+
+    port = os.getenv("FEELTUNE_METRICS_PORT")
+    if port:
+        try:
+            start_http_server(int(port))
+        except OSError as e:
+            # Another process (e.g. a second service worker) owns the port
+            logger.warning("Metrics endpoint not started on port %s: %s", port, e)
+    interval = os.getenv("FEELTUNE_METRICS_LOG_INTERVAL")
+    if interval:
+        start_log_reporter(float(interval))
@@ -0,0 +1,250 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+
+import metrics
+
+# Width and height album art is shown at by display_song
+THUMBNAIL_SIZE = 150
+# Spotify previews are ~30 s MP3s; anything far larger is not a preview
+MAX_PREVIEW_BYTES = 5 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 10
+# Seconds a page of songs waits, in total, for assets still downloading
+DISPLAY_WAIT = 0.5
+# The directory is recounted after this many downloads, since other
+# processes sharing it add files this one does not know about
+RECOUNT_EVERY = 16
+
+
+def asset_name(url, kind):
+    """File name an asset is stored under: a hash of its URL plus the kind's extension"""
+    return hashlib.sha1(url.encode()).hexdigest() + ('.jpg' if kind == 'image' else '.mp3')
+
+
+class AssetCache:
+    """Local copies of album art and audio previews, bounded in size on disk
+
+    prefetch() downloads the artwork and previews of songs concurrently;
+    artwork is stored as a THUMBNAIL_SIZE JPEG thumbnail. localize() swaps a
+    song's remote URLs for the cached files. When the files add up to more
+    than `max_bytes`, the least recently used ones are deleted. Several
+    processes can share the directory: each recounts it every RECOUNT_EVERY
+    downloads and whenever its own count passes the limit, and the LRU order
+    comes from file mtimes, so the total stays under `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024, workers=8, thumbnail_size=THUMBNAIL_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.bytes_downloaded = 0
+        self._files = OrderedDict()
+        self._size = 0
+        self._pending = {}
+        self._stores = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asset-fetch")
+        os.makedirs(directory, exist_ok=True)
+        # Pick up what earlier runs left behind
+        self._recount()
+
+    @property
+    def size(self):
+        return self._size
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _recount(self):
+        """Rebuild the LRU order and size from the files on disk, oldest first"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # Removed by another process meanwhile
+                    continue
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        files = OrderedDict((name, size) for _, name, size in sorted(entries))
+        with self._lock:
+            self._files = files
+            self._size = sum(files.values())
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+
+            session = self._local.session = requests.Session()
+        return session
+
+    def lookup(self, url, kind, wait=0.0):
+        """Path of the cached asset for `url`, or None
+
+        With `wait`, an asset that is still downloading is waited for up to
+        that many seconds.
+        """
+        name = asset_name(url, kind)
+        with self._lock:
+            future = self._pending.get(name)
+        if future is not None and wait > 0:
+            futures_wait([future], timeout=wait)
+        with self._lock:
+            cached = name in self._files
+            if cached:
+                self._files.move_to_end(name)
+        path = self.path(name)
+        if cached:
+            try:
+                # Keeps the LRU order across restarts, which is rebuilt from mtimes
+                os.utime(path)
+            except OSError:
+                # Evicted by another process sharing the directory
+                with self._lock:
+                    self._size -= self._files.pop(name, 0)
+                cached = False
+        metrics.inc("asset_cache_requests_total", kind=kind, result="hit" if cached else "miss")
+        return path if cached else None
+
+    def prefetch(self, songs):
+        """Start downloading the artwork and previews of songs that are not cached yet"""
+        for song in songs:
+            for kind, key in (('image', 'image_url'), ('preview', 'preview_url')):
+                url = song.get(key)
+                if not url or not url.startswith(('http://', 'https://')):
+                    continue
+                name = asset_name(url, kind)
+                with self._lock:
+                    if name in self._files or name in self._pending:
+                        continue
+                    self._pending[name] = self._executor.submit(self._download, url, kind, name)
+
+    def wait_for(self, songs, timeout):
+        """Wait up to `timeout` seconds in total for the songs' assets still downloading"""
+        names = [asset_name(song[key], kind) for song in songs
+                 for kind, key in (('image', 'image_url'), ('preview', 'preview_url')) if song.get(key)]
+        with self._lock:
+            pending = [self._pending[name] for name in names if name in self._pending]
+        if pending:
+            futures_wait(pending, timeout=timeout)
+
+    def localize(self, song, wait=0.0):
+        """Copy of the song whose image_url/preview_url point to cached files where available
+
+        With `wait`, assets still downloading are waited for up to that many
+        seconds in total.
+        """
+        song = dict(song)
+        deadline = time.monotonic() + wait
+        for kind, key in (('image', 'image_url'), ('preview', 'preview_url')):
+            if song.get(key):
+                path = self.lookup(song[key], kind, max(0.0, deadline - time.monotonic()))
+                if path is not None:
+                    song[key] = path
+        return song
+
+    def _download(self, url, kind, name):
+        try:
+            with metrics.span(f"assets.{kind}"):
+                response = self._session().get(url, timeout=DOWNLOAD_TIMEOUT, stream=True)
+                response.raise_for_status()
+                data = response.raw.read(MAX_PREVIEW_BYTES + 1, decode_content=True)
+                response.close()
+            if len(data) > MAX_PREVIEW_BYTES:
+                raise ValueError(f"{url} is larger than {MAX_PREVIEW_BYTES} bytes")
+            with self._lock:
+                self.bytes_downloaded += len(data)
+            metrics.inc("asset_bytes_downloaded_total", len(data), kind=kind)
+            if kind == 'image':
+                data = self._thumbnail(data)
+            self._store(name, data)
+        except Exception as e:
+            metrics.inc("errors_total", stage="assets", error=type(e).__name__)
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def _thumbnail(self, data):
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        image.thumbnail((self.thumbnail_size, self.thumbnail_size), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=85)
+        return output.getvalue()
+
+    def _store(self, name, data):
+        # Write under a temporary name first so readers never see a partial file
+        tmp = self.path(f"{name}.{threading.get_ident()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path(name))
+
+        with self._lock:
+            self._size += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            self._stores += 1
+            recount = self._size > self.max_bytes or self._stores % RECOUNT_EVERY == 0
+        if recount:
+            self._recount()
+
+        evicted = []
+        with self._lock:
+            while self._size > self.max_bytes and len(self._files) > 1:
+                old, size = self._files.popitem(last=False)
+                self._size -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self.path(old))
+            except OSError:
+                pass
+        if evicted:
+            metrics.inc("asset_cache_evictions_total", len(evicted))
+
+    def wait(self, timeout=None):
+        """Block until the downloads started so far have finished; False on timeout"""
+        with self._lock:
+            pending = list(self._pending.values())
+        _, not_done = futures_wait(pending, timeout=timeout)
+        return not not_done
+
+    def clear(self):
+        with self._lock:
+            names = list(self._files)
+            self._files.clear()
+            self._size = 0
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+
+
+_assets = None
+_assets_lock = threading.Lock()
+
+
+def get_asset_cache():
+    """Return the process-wide asset cache, or None when disabled
+
+    FEELTUNE_ASSET_DIR sets the directory (default .cache/assets) and
+    FEELTUNE_ASSET_CACHE_MB its size limit (default 200, 0 disables).
+    """
+    global _assets
+    max_mb = float(os.getenv("FEELTUNE_ASSET_CACHE_MB", "200"))
+    if max_mb <= 0:
+        return None
+    if _assets is None:
+        with _assets_lock:
+            if _assets is None:
+                directory = os.getenv("FEELTUNE_ASSET_DIR", ".cache/assets")
+                _assets = AssetCache(directory, int(max_mb * 1024 * 1024))
+    return _assets
@@ -0,0 +1,228 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Default freshness for Spotify responses, in seconds
+SEARCH_TTL = 6 * 3600
+TRACKS_TTL = 3600
+# How long an expired entry may still be served while it is refreshed
+STALE_TTL = 24 * 3600
+
+
+class MemoryCache:
+    """In-process LRU cache with a per-key TTL"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (value, expires_at, stale_until) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (value, now + ttl, now + ttl + stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """On-disk LRU cache shared by every worker process using the same file
+
+    Values must be JSON-serialisable, which Spotify API responses are.
+    """
+
+    def __init__(self, path, max_entries=4096):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, stale_until REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at, stale_until FROM cache WHERE key = ? AND stale_until > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), row[1], row[2]
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, stale_until, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(value), now + ttl, now + ttl + stale_ttl, now),
+        )
+        conn.execute(
+            "DELETE FROM cache WHERE stale_until <= ? OR key IN ("
+            " SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (now, self.max_entries),
+        )
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class CacheStats:
+    """Hit/stale/miss counters, shared by every thread that reads the cache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, key, result):
+        """Count one lookup of `key`; result is hit, stale or miss"""
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            elif result == "stale":
+                self.stale_hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("cache_requests_total", kind=key.split(':', 1)[0], result=result)
+
+    def as_dict(self):
+        with self._lock:
+            return {'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses}
+
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+stats = CacheStats()
+
+
+def _refresh(cache, key, loader, ttl, stale_ttl):
+    try:
+        cache.set(key, loader(), ttl, stale_ttl)
+    except Exception:
+        # Keep serving the stale value; the next request will try again
+        pass
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def get_or_load(cache, key, loader, ttl, stale_ttl=STALE_TTL):
+    """Return a cached value, calling loader() on a miss
+
+    A fresh entry is returned as is. An expired entry that is still within
+    its stale window is returned immediately while one background thread
+    reloads it (stale-while-revalidate). Otherwise loader() runs inline and
+    its exceptions propagate to the caller.
+    """
+    entry = cache.get(key)
+    now = time.time()
+
+    if entry is not None:
+        value, expires_at, _ = entry
+        if now < expires_at:
+            stats.record(key, "hit")
+            return value
+
+        stats.record(key, "stale")
+        with _refreshing_lock:
+            start = key not in _refreshing
+            _refreshing.add(key)
+        if start:
+            threading.Thread(target=_refresh, args=(cache, key, loader, ttl, stale_ttl),
+                             name="cache-refresh", daemon=True).start()
+        return value
+
+    stats.record(key, "miss")
+    value = loader()
+    cache.set(key, value, ttl, stale_ttl)
+    return value
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache
+
+    Set FEELTUNE_CACHE_PATH to a file path to share one SQLite cache across
+    worker processes; otherwise an in-memory cache is used.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = os.getenv("FEELTUNE_CACHE_PATH")
+                _cache = SQLiteCache(path) if path else MemoryCache()
+    return _cache
+
+
+def cached_search(sp, query, limit=1, cache=None):
+    """sp.search for playlists, served from the cache when possible"""
+    if cache is None:
+        cache = get_cache()
+    return get_or_load(cache, f"search:{query}:{limit}",
+                       metrics.timed("spotify.search", lambda: sp.search(q=query, type='playlist', limit=limit)),
+                       SEARCH_TTL)
+
+
+def cached_playlist_tracks(sp, playlist_id, cache=None):
+    """sp.playlist_tracks, served from the cache when possible"""
+    if cache is None:
+        cache = get_cache()
+    return get_or_load(cache, f"tracks:{playlist_id}",
+                       metrics.timed("spotify.playlist_tracks", lambda: sp.playlist_tracks(playlist_id)),
+                       TRACKS_TTL)
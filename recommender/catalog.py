@@ -0,0 +1,227 @@
+"""Offline track catalog used when Spotify is unavailable.
+
+Build or extend it with:
+
+    python -m recommender.catalog ingest recommender/fallback_tracks.json more_tracks.jsonl
+
+Input files are JSON ({emotion: [track, ...]} or a list of tracks), JSON
+Lines or CSV. A track needs a title and artist plus an `emotion` or a
+`genre`; the missing one is filled in from mood_mapping.json.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+
+CATALOG_PATH = 'recommender/catalog.db'
+SEED_PATH = 'recommender/fallback_tracks.json'
+MOOD_MAPPING_PATH = 'recommender/mood_mapping.json'
+
+TRACK_FIELDS = ('title', 'artist', 'album', 'preview_url', 'image_url', 'spotify_url')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    artist TEXT,
+    album TEXT,
+    preview_url TEXT,
+    image_url TEXT,
+    spotify_url TEXT,
+    genre TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_genre ON tracks (genre);
+-- Tracks are numbered 0..n-1 within each emotion, so k random tracks are
+-- k primary-key lookups instead of a scan
+CREATE TABLE IF NOT EXISTS track_emotions (
+    emotion TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    track_id INTEGER NOT NULL REFERENCES tracks (id),
+    PRIMARY KEY (emotion, pos),
+    UNIQUE (emotion, track_id)
+);
+"""
+
+
+def load_mood_mapping(path=MOOD_MAPPING_PATH):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _track_key(track):
+    """Stable identity for deduplication: the Spotify URL, else artist + title"""
+    if track.get('spotify_url'):
+        return track['spotify_url']
+    return f"{track.get('artist', '')}|{track['title']}".lower()
+
+
+class TrackCatalog:
+    """SQLite-backed catalog of tracks indexed by emotion and genre"""
+
+    def __init__(self, path=CATALOG_PATH, mood_mapping=None):
+        self.path = path
+        self.mood_mapping = mood_mapping if mood_mapping is not None else load_mood_mapping()
+        self._emotions_by_genre = {}
+        for emotion, genre in self.mood_mapping.items():
+            self._emotions_by_genre.setdefault(genre, []).append(emotion)
+        self._counts = {}
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def ingest(self, tracks):
+        """Add tracks to the catalog; returns the number of new emotion tags"""
+        conn = self._connect()
+        added = 0
+        with conn:
+            positions = dict(conn.execute("SELECT emotion, COUNT(*) FROM track_emotions GROUP BY emotion"))
+            for track in tracks:
+                emotion = (track.get('emotion') or '').lower() or None
+                genre = (track.get('genre') or '').lower() or None
+                if genre is None and emotion is not None:
+                    genre = self.mood_mapping.get(emotion)
+                emotions = [emotion] if emotion else self._emotions_by_genre.get(genre, [])
+                if not track.get('title') or not emotions:
+                    continue
+
+                key = _track_key(track)
+                conn.execute(
+                    "INSERT OR IGNORE INTO tracks (key, title, artist, album, preview_url, image_url, spotify_url, genre)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, *(track.get(field) for field in TRACK_FIELDS), genre),
+                )
+                track_id = conn.execute("SELECT id FROM tracks WHERE key = ?", (key,)).fetchone()[0]
+
+                for emotion in emotions:
+                    pos = positions.get(emotion, 0)
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO track_emotions (emotion, pos, track_id) VALUES (?, ?, ?)",
+                        (emotion, pos, track_id),
+                    )
+                    if cursor.rowcount:
+                        positions[emotion] = pos + 1
+                        added += 1
+        self._counts.clear()
+        return added
+
+    def count(self, emotion):
+        if emotion not in self._counts:
+            row = self._connect().execute(
+                "SELECT COUNT(*) FROM track_emotions WHERE emotion = ?", (emotion,)).fetchone()
+            self._counts[emotion] = row[0]
+        return self._counts[emotion]
+
+    def sample(self, emotion, k=5):
+        """Return up to k random tracks tagged with an emotion, in O(k)"""
+        n = self.count(emotion)
+        if n == 0:
+            return []
+        positions = random.sample(range(n), min(k, n))
+        placeholders = ','.join('?' * len(positions))
+        rows = self._connect().execute(
+            f"SELECT t.* FROM track_emotions e JOIN tracks t ON t.id = e.track_id"
+            f" WHERE e.emotion = ? AND e.pos IN ({placeholders})",
+            (emotion, *positions),
+        ).fetchall()
+        songs = [self._song(row) for row in rows]
+        random.shuffle(songs)
+        return songs
+
+    def by_genre(self, genre, k=5):
+        rows = self._connect().execute(
+            "SELECT * FROM tracks WHERE genre = ? LIMIT ?", (genre, k)).fetchall()
+        return [self._song(row) for row in rows]
+
+    @staticmethod
+    def _song(row):
+        song = {field: row[field] for field in TRACK_FIELDS}
+        song['genre'] = row['genre']
+        return song
+
+
+def read_tracks(path):
+    """Yield track dicts from a JSON, JSON Lines or CSV file"""
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    elif path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for emotion, tracks in data.items():
+                for track in tracks:
+                    yield {'emotion': emotion, **track}
+        else:
+            yield from data
+
+
+_catalog = None
+_seed = None
+_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the shared catalog, or None if it has not been built"""
+    global _catalog
+    if _catalog is None and os.path.exists(CATALOG_PATH):
+        with _lock:
+            if _catalog is None:
+                _catalog = TrackCatalog(CATALOG_PATH)
+    return _catalog
+
+
+def sample_tracks(emotion, k=5):
+    """Random offline tracks for an emotion
+
+    Uses the built catalog when there is one, otherwise the seed file, which
+    is parsed once per process.
+    """
+    global _seed
+    catalog = get_catalog()
+    if catalog is not None:
+        return catalog.sample(emotion, k)
+
+    if _seed is None:
+        with open(SEED_PATH, encoding='utf-8') as f:
+            _seed = json.load(f)
+    songs = _seed.get(emotion, [])
+    return random.sample(songs, min(k, len(songs)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the offline FeelTune track catalog")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help="add tracks from JSON, JSONL or CSV files")
+    ingest.add_argument('files', nargs='*', default=[SEED_PATH])
+    ingest.add_argument('--db', default=CATALOG_PATH)
+    args = parser.parse_args(argv)
+
+    catalog = TrackCatalog(args.db)
+    for path in args.files:
+        added = catalog.ingest(read_tracks(path))
+        print(f"{path}: {added} new emotion tags")
+    for emotion in catalog.mood_mapping:
+        print(f"  {emotion}: {catalog.count(emotion)} tracks")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import contextvars
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FetchTimeout(Exception):
+    """The fetch did not finish before its deadline; it keeps running in the background"""
+
+
+class RetryPolicy:
+    """How often and how long to retry a failing Spotify call
+
+    Delays grow exponentially from `base_delay` up to `max_delay`, each
+    randomised by +/- `jitter` (a fraction). No new attempt starts once
+    `total_budget` seconds have been spent.
+    """
+
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=4.0, jitter=0.5, total_budget=8.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.total_budget = total_budget
+
+    @classmethod
+    def from_env(cls):
+        """Build a policy from FEELTUNE_RETRY_* environment variables"""
+        defaults = cls()
+        return cls(
+            # Fewer than one attempt would never call Spotify at all
+            attempts=max(1, int(os.getenv("FEELTUNE_RETRY_ATTEMPTS", defaults.attempts))),
+            base_delay=float(os.getenv("FEELTUNE_RETRY_BASE_DELAY", defaults.base_delay)),
+            max_delay=float(os.getenv("FEELTUNE_RETRY_MAX_DELAY", defaults.max_delay)),
+            jitter=float(os.getenv("FEELTUNE_RETRY_JITTER", defaults.jitter)),
+            total_budget=float(os.getenv("FEELTUNE_RETRY_BUDGET", defaults.total_budget)),
+        )
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+def call_with_retry(fn, policy=None):
+    """Call fn() until it succeeds, following the retry policy
+
+    Meant to run on a worker thread: the backoff sleeps never block the
+    Streamlit script thread. The last exception is re-raised.
+    """
+    policy = policy or RetryPolicy.from_env()
+    started = time.monotonic()
+
+    for attempt in range(policy.attempts):
+        try:
+            return fn()
+        except Exception as e:
+            delay = policy.delay(attempt)
+            out_of_budget = time.monotonic() - started + delay > policy.total_budget
+            if attempt == policy.attempts - 1 or out_of_budget:
+                raise
+            logger.warning("Spotify call failed (attempt %d): %s. Retrying in %.1fs", attempt + 1, e, delay)
+            metrics.inc("spotify_retries_total", error=type(e).__name__)
+            with metrics.span("spotify.retry_sleep"):
+                time.sleep(delay)
+
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="spotify-fetch")
+
+
+def default_deadline():
+    """Seconds a user waits for Spotify before getting local recommendations"""
+    return float(os.getenv("FEELTUNE_SPOTIFY_DEADLINE", "3.0"))
+
+
+def submit(fn, policy=None):
+    """Start fn() with retries on the shared fetch pool and return its future"""
+    # Run in a copy of the caller's context so its metrics trace follows
+    return _executor.submit(contextvars.copy_context().run, call_with_retry, fn, policy)
+
+
+def fetch_with_deadline(fn, deadline=None, policy=None):
+    """Run fn() with retries, waiting at most `deadline` seconds for it
+
+    Raises FetchTimeout when the deadline passes. The call is not cancelled:
+    it finishes in the background, so anything it caches is warm for the
+    next request.
+    """
+    timeout = default_deadline() if deadline is None else deadline
+    future = submit(fn, policy)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        raise FetchTimeout(f"Spotify did not respond within {timeout:.1f}s")
+
+
+async def fetch_async(fn, deadline=None, policy=None):
+    """asyncio version of fetch_with_deadline for async callers"""
+    import asyncio
+
+    timeout = default_deadline() if deadline is None else deadline
+    future = asyncio.wrap_future(submit(fn, policy))
+    try:
+        # shield() keeps the background fetch alive when the wait times out
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        raise FetchTimeout(f"Spotify did not respond within {timeout:.1f}s")
@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+from recommender.cache import SEARCH_TTL, TRACKS_TTL, get_cache, get_or_load
+from recommender.fetch import call_with_retry
+from recommender.scoring import add_spotify_features, feature_store
+
+# How many playlists feed one emotion's candidate pool
+POOL_PLAYLISTS = 5
+# Spotify's maximum page size for playlist items
+PAGE_SIZE = 100
+# How long a built pool is used before it is rebuilt in the background
+POOL_TTL = 3600
+
+
+def song_from_track(track):
+    """Convert a Spotify track object into the song dict the UI displays"""
+    return {
+        "id": track.get('id'),
+        "title": track['name'],
+        "artist": track['artists'][0]['name'] if track['artists'] else "Unknown Artist",
+        "album": track['album']['name'] if 'album' in track else "Unknown Album",
+        "preview_url": track.get('preview_url'),
+        "image_url": track['album']['images'][0]['url'] if track['album']['images'] else None,
+        "spotify_url": track['external_urls']['spotify'] if 'external_urls' in track else None
+    }
+
+
+def _fetch_page(sp, playlist_id, offset, cache):
+    return get_or_load(
+        cache, f"tracks:{playlist_id}:{offset}",
+        lambda: call_with_retry(metrics.timed(
+            "spotify.playlist_tracks", lambda: sp.playlist_tracks(playlist_id, limit=PAGE_SIZE, offset=offset))),
+        TRACKS_TTL,
+    )
+
+
+def fetch_all_tracks(sp, playlist_id, executor, cache=None):
+    """Return every item of a playlist, fetching pages after the first concurrently"""
+    if cache is None:
+        cache = get_cache()
+    first = _fetch_page(sp, playlist_id, 0, cache)
+    if not first:
+        return []
+
+    total = first.get('total') or len(first['items'])
+    offsets = range(PAGE_SIZE, total, PAGE_SIZE)
+    futures = [executor.submit(_fetch_page, sp, playlist_id, offset, cache) for offset in offsets]
+
+    items = list(first['items'])
+    for future in futures:
+        try:
+            items.extend(future.result()['items'])
+        except Exception:
+            # A missing page only shrinks the pool
+            continue
+    return items
+
+
+def build_candidate_pool(sp, query, executor, n_playlists=POOL_PLAYLISTS, cache=None):
+    """Merge the tracks of the top playlists for a query, deduplicated by track ID"""
+    if cache is None:
+        cache = get_cache()
+    results = get_or_load(
+        cache, f"search:{query}:{n_playlists}",
+        lambda: call_with_retry(metrics.timed(
+            "spotify.search", lambda: sp.search(q=query, type='playlist', limit=n_playlists))),
+        SEARCH_TTL,
+    )
+    # Spotify can return null entries for playlists that were removed
+    playlists = [p for p in results['playlists']['items'] if p]
+
+    pool = []
+    seen = set()
+    for playlist in playlists:
+        try:
+            items = fetch_all_tracks(sp, playlist['id'], executor, cache)
+        except Exception:
+            continue
+        for item in items:
+            track = item.get('track') if item else None
+            if not track or not track.get('id') or track['id'] in seen:
+                continue
+            try:
+                song = song_from_track(track)
+            except (AttributeError, KeyError, IndexError):
+                continue
+            seen.add(track['id'])
+            pool.append(song)
+    return pool
+
+
+class CandidatePoolManager:
+    """Builds and shares one candidate pool per emotion, off the request path
+
+    get() never blocks on Spotify: it returns the current pool (possibly
+    stale, or None before the first build) and schedules a background build
+    when the pool is missing or older than `ttl`.
+    """
+
+    def __init__(self, n_playlists=POOL_PLAYLISTS, ttl=POOL_TTL, page_workers=8):
+        self.n_playlists = n_playlists
+        self.ttl = ttl
+        self._pools = {}
+        self._building = set()
+        self._lock = threading.Lock()
+        self._builder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pool-builder")
+        # Page requests get their own bounded pool so builders never starve it
+        self._pages = ThreadPoolExecutor(max_workers=page_workers, thread_name_prefix="pool-pages")
+
+    def get(self, sp, emotion, query):
+        with self._lock:
+            entry = self._pools.get(emotion)
+            expired = entry is None or time.time() - entry[1] > self.ttl
+            if expired and emotion not in self._building:
+                self._building.add(emotion)
+                self._builder.submit(self._build, sp, emotion, query)
+        return entry[0] if entry else None
+
+    def _build(self, sp, emotion, query):
+        try:
+            with metrics.span("pool.build"):
+                pool = build_candidate_pool(sp, query, self._pages, self.n_playlists)
+            if pool:
+                with self._lock:
+                    self._pools[emotion] = (pool, time.time())
+                add_spotify_features(feature_store, sp, pool, self._pages)
+        except Exception as e:
+            metrics.inc("errors_total", stage="pool.build", error=type(e).__name__)
+        finally:
+            with self._lock:
+                self._building.discard(emotion)
+
+    def clear(self):
+        """Drop every built pool, e.g. between benchmark runs"""
+        with self._lock:
+            self._pools.clear()
+
+    def warm(self, sp, queries):
+        """Start building pools for {emotion: query} ahead of the first request"""
+        for emotion, query in queries.items():
+            self.get(sp, emotion, query)
+
+
+pool_manager = CandidatePoolManager()
@@ -0,0 +1,181 @@
+import threading
+
+import numpy as np
+
+import metrics
+
+from recommender.cache import get_cache, get_or_load
+from recommender.fetch import call_with_retry
+
+FEATURES = ('valence', 'energy', 'tempo', 'danceability', 'acousticness')
+# Same order as emotion_model.emotion_utils.EMOTION_LABELS, so a probability
+# vector from the model can be mixed directly into a target vector
+EMOTION_ORDER = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+
+# Target audio profile per emotion, on the normalised 0..1 feature scale
+# (valence, energy, tempo, danceability, acousticness)
+EMOTION_TARGETS = {
+    "happy":    (0.85, 0.80, 0.60, 0.75, 0.15),
+    "sad":      (0.15, 0.25, 0.30, 0.30, 0.75),
+    "angry":    (0.25, 0.95, 0.75, 0.45, 0.05),
+    "fear":     (0.35, 0.20, 0.30, 0.25, 0.80),
+    "surprise": (0.70, 0.80, 0.65, 0.75, 0.15),
+    "neutral":  (0.50, 0.40, 0.45, 0.55, 0.50),
+    "disgust":  (0.40, 0.45, 0.50, 0.35, 0.40),
+}
+TARGET_MATRIX = np.array([EMOTION_TARGETS[e] for e in EMOTION_ORDER], dtype=np.float32)
+
+# Relative importance of each feature in the distance
+FEATURE_WEIGHTS = np.array([1.0, 1.0, 0.4, 0.6, 0.5], dtype=np.float32)
+
+# Above this many tracks, top_k narrows the candidates with a threshold
+# estimated from a random sample before partitioning
+SAMPLE_ABOVE = 32768
+SAMPLE_SIZE = 4096
+
+# Spotify's audio-features endpoint accepts at most 100 IDs per call
+FEATURES_BATCH = 100
+FEATURES_TTL = 30 * 24 * 3600
+
+
+def normalise_features(features):
+    """Map a Spotify audio-features object onto the 0..1 scale used for scoring"""
+    tempo = min(max((features['tempo'] - 60.0) / 140.0, 0.0), 1.0)
+    return (features['valence'], features['energy'], tempo,
+            features['danceability'], features['acousticness'])
+
+
+def target_vector(emotion_or_probabilities):
+    """Target features for an emotion label or a full probability vector"""
+    if isinstance(emotion_or_probabilities, str):
+        return TARGET_MATRIX[EMOTION_ORDER.index(emotion_or_probabilities.lower())]
+    probabilities = np.asarray(emotion_or_probabilities, dtype=np.float32)
+    return probabilities @ TARGET_MATRIX / max(float(probabilities.sum()), 1e-6)
+
+
+def _nearest(distances, count, rng):
+    """Indices of the `count` smallest distances, in no particular order
+
+    For large arrays a threshold is taken from a random sample so that only
+    the few hundred tracks below it are partitioned; the result is the same
+    as a full argpartition, which is the fallback when too few fall below.
+    """
+    n = len(distances)
+    if n > SAMPLE_ABOVE:
+        sample = distances[rng.integers(0, n, SAMPLE_SIZE)]
+        # Expect about 4 * count tracks below the threshold, plus a margin
+        rank = min(SAMPLE_SIZE - 1, int(4 * count * SAMPLE_SIZE / n) + 8)
+        threshold = np.partition(sample, rank)[rank]
+        candidates = np.flatnonzero(distances <= threshold)
+        if len(candidates) >= count:
+            return candidates[np.argpartition(distances[candidates], count - 1)[:count]]
+    return np.argpartition(distances, count - 1)[:count]
+
+
+class FeatureStore:
+    """Audio features of every known track in one contiguous float32 array
+
+    Features are stored feature-major (one contiguous row per feature),
+    pre-multiplied by sqrt(weight) and with their squared norms. Queries
+    use a packed copy with the norms as an extra row, rebuilt after adds,
+    so scoring all tracks is one vector-matrix product into a reused buffer.
+    """
+
+    def __init__(self, capacity=1024):
+        self._weights = np.sqrt(FEATURE_WEIGHTS)
+        self._features = np.empty((len(FEATURES), capacity), dtype=np.float32)
+        self._norms = np.empty(capacity, dtype=np.float32)
+        self._distances = np.empty(capacity, dtype=np.float32)
+        self._packed = None
+        self._songs = []
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+
+    def __len__(self):
+        return len(self._songs)
+
+    def __contains__(self, track_id):
+        return track_id in self._rows
+
+    def add(self, song, features):
+        """Add or update a song with its normalised feature tuple"""
+        vector = np.asarray(features, dtype=np.float32) * self._weights
+        with self._lock:
+            row = self._rows.get(song['id'])
+            if row is None:
+                row = len(self._songs)
+                if row == self._features.shape[1]:
+                    self._grow()
+                self._rows[song['id']] = row
+                self._songs.append(song)
+            else:
+                self._songs[row] = song
+            self._features[:, row] = vector
+            self._norms[row] = vector @ vector
+            self._packed = None
+
+    def _grow(self):
+        n = len(self._songs)
+        capacity = self._features.shape[1] * 2
+        features = np.empty((len(FEATURES), capacity), dtype=np.float32)
+        norms = np.empty(capacity, dtype=np.float32)
+        features[:, :n] = self._features[:, :n]
+        norms[:n] = self._norms[:n]
+        self._features, self._norms = features, norms
+        self._distances = np.empty(capacity, dtype=np.float32)
+
+    def top_k(self, emotion_or_probabilities, k=5, explore=4, rng=None):
+        """Return k songs closest to the target profile
+
+        The k * explore nearest tracks are found with argpartition and k of
+        them are drawn at random, so repeated queries still vary.
+        """
+        # |f - t|^2 = |f|^2 - 2 f.t + |t|^2; the last term is the same for all
+        # tracks, and the packed matrix's last row holds |f|^2
+        target = np.append(target_vector(emotion_or_probabilities) * self._weights * -2.0, 1.0)
+        target = target.astype(np.float32)
+        rng = rng or self._rng
+        with self._lock:
+            n = len(self._songs)
+            if n == 0:
+                return []
+            if self._packed is None:
+                self._packed = np.vstack([self._features[:, :n], self._norms[None, :n]])
+            distances = self._distances[:n]
+            np.dot(target, self._packed, out=distances)
+
+            shortlist = min(n, max(k, k * explore))
+            nearest = _nearest(distances, shortlist, rng) if shortlist < n else np.arange(n)
+            picked = rng.choice(nearest, size=min(k, len(nearest)), replace=False)
+            picked = picked[np.argsort(distances[picked])]
+            return [self._songs[i] for i in picked]
+
+
+def add_spotify_features(store, sp, songs, executor, cache=None):
+    """Fetch audio features for songs not yet in the store, in parallel batches"""
+    if cache is None:
+        cache = get_cache()
+    missing = [song for song in songs if song.get('id') and song['id'] not in store]
+    by_id = {song['id']: song for song in missing}
+    ids = list(by_id)
+
+    def fetch(batch):
+        load = metrics.timed("spotify.audio_features", lambda: sp.audio_features(batch))
+        return get_or_load(cache, "features:" + ",".join(batch), lambda: call_with_retry(load), FEATURES_TTL)
+
+    batches = [ids[i:i + FEATURES_BATCH] for i in range(0, len(ids), FEATURES_BATCH)]
+    for future in [executor.submit(fetch, batch) for batch in batches]:
+        try:
+            results = future.result()
+        except Exception:
+            continue
+        for features in results or []:
+            if features and features.get('id') in by_id:
+                try:
+                    store.add(by_id[features['id']], normalise_features(features))
+                except (KeyError, TypeError):
+                    continue
+
+
+feature_store = FeatureStore()
@@ -0,0 +1,121 @@
+import itertools
+import random
+from collections import deque
+
+import metrics
+import reporting
+from recommender.assets import get_asset_cache
+from recommender.catalog import sample_tracks
+from recommender.pool import pool_manager
+from recommender.recommender import EMOTION_PLAYLISTS, MIN_SCORED_TRACKS, fetch_songs
+from recommender.scoring import EMOTION_TARGETS, feature_store
+
+# Songs added to an emotion's queue per refill
+REFILL_SIZE = 30
+# Refill once fewer songs than this are queued
+LOW_WATER = 10
+
+
+def song_key(song):
+    return song.get('id') or (song.get('title'), song.get('artist'))
+
+
+class RecommendationSession:
+    """Non-repeating recommendations for one user session
+
+    Every emotion gets a shuffled queue of candidates, and `seen` holds the
+    songs already shown. next_songs() pops the next k songs from the queue,
+    so "more songs" is instant. The queue is refilled from the shared
+    candidate pool only when it runs low; Spotify is only asked while that
+    emotion's pool is still being built, and the answer is cached. Once
+    every candidate has been shown, the emotion starts over.
+    """
+
+    def __init__(self, refill_size=REFILL_SIZE, low_water=LOW_WATER, rng=None):
+        self.refill_size = refill_size
+        self.low_water = low_water
+        self.seen = set()
+        self.history = []
+        self.refills = 0
+        self._queues = {}
+        self._rng = rng or random.Random()
+
+    def next_songs(self, emotion, sp=None, k=5, probabilities=None, deadline=None, policy=None):
+        """Return up to k songs for the emotion that this session has not seen yet"""
+        emotion = emotion.lower()
+        queue = self._queues.setdefault(emotion, deque())
+        if len(queue) < max(k, self.low_water):
+            self._refill(queue, emotion, sp, probabilities, deadline, policy)
+
+        songs = []
+        while queue and len(songs) < k:
+            song = queue.popleft()
+            # The song may have been shown from another emotion's queue since
+            if song_key(song) not in self.seen:
+                songs.append(song)
+
+        for song in songs:
+            self.seen.add(song_key(song))
+            self.history.append((emotion, song))
+        metrics.inc("recommendations_total", path="session")
+
+        assets = get_asset_cache()
+        if assets is not None:
+            # Artwork and previews for these songs and the next "more songs"
+            assets.prefetch(songs + list(itertools.islice(queue, k)))
+        return songs
+
+    def queued(self, emotion):
+        return len(self._queues.get(emotion.lower(), ()))
+
+    def reset(self):
+        self.seen.clear()
+        self.history.clear()
+        self._queues.clear()
+
+    def _refill(self, queue, emotion, sp, probabilities, deadline, policy):
+        candidates, source = self._candidates(emotion, sp, probabilities, deadline, policy)
+        skip = self.seen | {song_key(song) for song in queue}
+        if not queue and all(song_key(song) in skip for song in candidates):
+            # Everything was shown: start the cycle over for this emotion
+            skip = set()
+            self.seen.difference_update(song_key(song) for song in candidates)
+        for song in candidates:
+            key = song_key(song)
+            if key not in skip:
+                skip.add(key)
+                queue.append(song)
+        self.refills += 1
+        metrics.inc("session_refills_total", source=source)
+
+    def _candidates(self, emotion, sp, probabilities, deadline, policy):
+        """Return (songs in the order to play them, where they came from)"""
+        if sp is None:
+            return self._offline(emotion), "fallback"
+
+        query = EMOTION_PLAYLISTS.get(emotion, "lofi chill")
+        pool = pool_manager.get(sp, emotion, query)
+        if pool:
+            if len(feature_store) >= MIN_SCORED_TRACKS and emotion in EMOTION_TARGETS:
+                # Closest matches first; ask past what was already shown
+                target = probabilities if probabilities is not None else emotion
+                return feature_store.top_k(target, k=len(self.seen) + self.refill_size, explore=2), "scored"
+            return self._shuffled(pool), "pool"
+
+        # The pool is still being built; one playlist (cached) fills the queue meanwhile
+        songs = fetch_songs(sp, query, deadline, policy)
+        if songs:
+            return self._shuffled(songs), "fetch"
+        reporting.warning("Using offline song recommendations due to connectivity issues with Spotify API.")
+        return self._offline(emotion), "fallback"
+
+    def _offline(self, emotion):
+        songs = sample_tracks(emotion, self.refill_size) or sample_tracks("neutral", self.refill_size)
+        return self._shuffled(songs)
+
+    def _shuffled(self, songs):
+        """Random order, songs with a playable preview first"""
+        songs = list(songs)
+        self._rng.shuffle(songs)
+        with_preview = [song for song in songs if song.get('preview_url')]
+        return with_preview + [song for song in songs if not song.get('preview_url')]
@@ -0,0 +1,72 @@
+import hashlib
+import random
+import threading
+import time
+
+
+class StubSpotify:
+    """Offline stand-in for spotipy.Spotify with deterministic fake data
+
+    Implements the calls the recommender makes (search, playlist_tracks,
+    audio_features). `latency` adds a delay per call and `failure_rate` makes
+    that fraction of calls raise, to exercise timeouts and retries.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, playlist_size=250, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.playlist_size = playlist_size
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ConnectionError("StubSpotify: simulated failure")
+
+    @staticmethod
+    def _digest(*parts):
+        return hashlib.sha1(":".join(str(p) for p in parts).encode()).hexdigest()[:22]
+
+    def search(self, q, type='playlist', limit=10, offset=0):
+        self._call()
+        items = [{'id': self._digest(q, i), 'name': f"{q.title()} #{i + 1}"} for i in range(offset, offset + limit)]
+        return {'playlists': {'items': items, 'total': 100}}
+
+    def _track(self, playlist_id, index):
+        track_id = self._digest(playlist_id, index % (self.playlist_size * 2 // 3 or 1))
+        return {
+            'id': track_id,
+            'name': f"Track {track_id[:6]}",
+            'artists': [{'name': f"Artist {track_id[6:10]}"}],
+            'album': {'name': f"Album {track_id[10:14]}",
+                      'images': [{'url': f"https://i.scdn.co/image/{track_id}"}]},
+            'preview_url': f"https://p.scdn.co/mp3-preview/{track_id}" if index % 4 else None,
+            'external_urls': {'spotify': f"https://open.spotify.com/track/{track_id}"},
+        }
+
+    def playlist_tracks(self, playlist_id, limit=100, offset=0, **kwargs):
+        self._call()
+        end = min(self.playlist_size, offset + limit)
+        items = [{'track': self._track(playlist_id, i)} for i in range(offset, end)]
+        return {'items': items, 'total': self.playlist_size, 'offset': offset, 'limit': limit}
+
+    def audio_features(self, tracks):
+        self._call()
+        features = []
+        for track_id in tracks:
+            rng = random.Random(track_id)
+            features.append({
+                'id': track_id,
+                'valence': rng.random(),
+                'energy': rng.random(),
+                'tempo': rng.uniform(60, 200),
+                'danceability': rng.random(),
+                'acousticness': rng.random(),
+            })
+        return features
@@ -0,0 +1,96 @@
+"""Where library code sends messages meant for the user.
+
+The emotion_model and recommender modules call reporting.warning() and
+friends instead of st.*, so they import without Streamlit and work in the
+CLI tools and the HTTP service. Messages go to the logging module unless
+the app installs StreamlitReporter, which shows them on the page.
+"""
+import contextlib
+import logging
+
+logger = logging.getLogger("feeltune")
+
+
+class LogReporter:
+    """Default reporter: messages become log records, spinners do nothing"""
+
+    def info(self, message):
+        logger.info(message)
+
+    def warning(self, message):
+        logger.warning(message)
+
+    def error(self, message):
+        logger.error(message)
+
+    def spinner(self, message):
+        return contextlib.nullcontext()
+
+
+class StreamlitReporter(LogReporter):
+    """Shows messages in the running Streamlit page
+
+    Messages from threads outside a script run (background loading and
+    fetching) have no page to go to and are logged instead.
+    """
+
+    def __init__(self):
+        import streamlit as st
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        self._st = st
+        self._get_ctx = get_script_run_ctx
+
+    def _on_page(self):
+        return self._get_ctx(suppress_warning=True) is not None
+
+    def info(self, message):
+        if self._on_page():
+            self._st.info(message)
+        else:
+            super().info(message)
+
+    def warning(self, message):
+        if self._on_page():
+            self._st.warning(message)
+        else:
+            super().warning(message)
+
+    def error(self, message):
+        if self._on_page():
+            self._st.error(message)
+        else:
+            super().error(message)
+
+    def spinner(self, message):
+        return self._st.spinner(message) if self._on_page() else super().spinner(message)
+
+
+_reporter = LogReporter()
+
+
+def set_reporter(reporter):
+    """Install the reporter used by every module from now on; returns the previous one"""
+    global _reporter
+    previous, _reporter = _reporter, reporter
+    return previous
+
+
+def get_reporter():
+    return _reporter
+
+
+def info(message):
+    _reporter.info(message)
+
+
+def warning(message):
+    _reporter.warning(message)
+
+
+def error(message):
+    _reporter.error(message)
+
+
+def spinner(message):
+    return _reporter.spinner(message)
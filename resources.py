@@ -0,0 +1,156 @@
+import os
+import threading
+
+# Files whose modification invalidates a cached resource
+MODEL_FILES = ('emotion_model/fer.json', 'emotion_model/fer.h5', 'emotion_model/fer_folded.npz',
+               'emotion_model/fer.onnx', 'emotion_model/fer.tflite',
+               'emotion_model/fer_folded_int8.npz', 'emotion_model/fer_int8.onnx', 'emotion_model/fer_int8.tflite',
+               'emotion_model/fer_folded_pruned.npz', 'emotion_model/fer_pruned.onnx',
+               'emotion_model/fer_folded_pruned_int8.npz', 'emotion_model/fer_pruned_int8.onnx')
+SPOTIFY_FILES = ('.env',)
+
+
+class ResourceRegistry:
+    """Process-wide, thread-safe cache of expensive shared resources.
+
+    Each resource is loaded once per server process and shared by every
+    Streamlit session. A resource is reloaded when one of its watched files
+    changes on disk or when reload() is called explicitly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaders = {}
+        self._entries = {}
+        self._load_locks = {}
+        self._warm_thread = None
+
+    def register(self, name, loader, watch=()):
+        """Register a zero-argument loader under a name"""
+        with self._lock:
+            self._loaders[name] = (loader, tuple(watch))
+            self._load_locks.setdefault(name, threading.Lock())
+            self._entries.pop(name, None)
+
+    def _signature(self, name):
+        _, watch = self._loaders[name]
+        signature = []
+        for path in watch:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def get(self, name, reload=False):
+        """Return the cached resource, loading it on first use"""
+        if name not in self._loaders:
+            raise KeyError(f"Unknown resource: {name}")
+
+        signature = self._signature(name)
+        entry = self._entries.get(name)
+        if entry is not None and not reload and entry[1] == signature:
+            return entry[0]
+
+        # Only one thread loads a given resource; the others wait for it
+        with self._load_locks[name]:
+            entry = self._entries.get(name)
+            if entry is not None and not reload and entry[1] == signature:
+                return entry[0]
+
+            loader, _ = self._loaders[name]
+            value = loader()
+            # Failed loads are cached too, so a missing file is not retried
+            # on every rerun - it is retried once the file shows up
+            self._entries[name] = (value, signature)
+            return value
+
+    def reload(self, name=None):
+        """Force a reload of one resource, or of all of them"""
+        names = [name] if name is not None else list(self._loaders)
+        return {n: self.get(n, reload=True) for n in names}
+
+    def is_loaded(self, name):
+        return name in self._entries
+
+    def warm_up(self, names=None, background=True):
+        """Load resources ahead of the first request.
+
+        Warm-up only runs once per process; later calls return the
+        existing thread (or None when warm-up ran in the foreground).
+        """
+        names = list(names) if names is not None else list(self._loaders)
+
+        with self._lock:
+            if self._warm_thread is not None:
+                return self._warm_thread
+
+            def _load_all():
+                for n in names:
+                    try:
+                        self.get(n)
+                    except Exception:
+                        pass
+
+            if not background:
+                self._warm_thread = threading.current_thread()
+                _load_all()
+                return None
+
+            self._warm_thread = threading.Thread(target=_load_all, name="resource-warmup", daemon=True)
+            self._warm_thread.start()
+            return self._warm_thread
+
+
+def _load_model():
+    from emotion_model.emotion_utils import load_emotion_model
+    return load_emotion_model()
+
+
+def _load_face_detector():
+    from emotion_model.face_detector import get_face_detector
+    return get_face_detector()
+
+
+def _load_spotify():
+    from recommender.recommender import setup_spotify
+    return setup_spotify()
+
+
+registry = ResourceRegistry()
+registry.register("emotion_model", _load_model, watch=MODEL_FILES)
+registry.register("face_detector", _load_face_detector)
+registry.register("spotify", _load_spotify, watch=SPOTIFY_FILES)
+
+
+def get_emotion_model():
+    """Return the process-wide emotion model"""
+    return registry.get("emotion_model")
+
+
+def get_spotify_client():
+    """Return the process-wide Spotify client"""
+    return registry.get("spotify")
+
+
+def is_ready(name="emotion_model"):
+    """True once a resource has been loaded (successfully or not)"""
+    return registry.is_loaded(name)
+
+
+def warm_up(background=True):
+    """Start loading all shared resources"""
+    return registry.warm_up(background=background)
+
+
+def reload_resources(name=None):
+    """Reload shared resources, e.g. after the model files were replaced"""
+    return registry.reload(name)
+
+
+if __name__ == "__main__":
+    # Pre-load everything once, e.g. from a container start-up hook
+    warm_up(background=False)
+    for resource in ("emotion_model", "spotify"):
+        print(f"{resource}: {'ok' if registry.get(resource) is not None else 'unavailable'}")
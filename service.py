@@ -0,0 +1,265 @@
+"""Standalone HTTP inference service for FeelTune.
+
+    python service.py --port 8000 --workers 4 [--stub-spotify]
+
+Endpoints:
+    POST /detect     raw image bytes (JPEG/PNG) -> emotion and per-face results
+    POST /recommend  {"emotion": ..., "probabilities": [...]} -> songs
+    GET  /healthz    process is up
+    GET  /readyz     model is loaded and the service can take traffic
+    GET  /metrics    Prometheus metrics of this worker (with FEELTUNE_METRICS=1)
+    GET  /assets/... cached album art thumbnails and previews linked from /recommend
+
+Each worker process loads its own model. Concurrent /detect requests are
+micro-batched: faces that arrive within a few milliseconds of each other
+are classified in one forward pass.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+import metrics
+from emotion_model.pipeline import MicroBatcher
+
+# Names recommender.assets stores files under; anything else is never opened
+ASSET_NAME = re.compile(r"[0-9a-f]{40}\.(jpg|mp3)")
+
+
+def parse_recommend_request(body):
+    """(emotion, probabilities) of a /recommend body; ValueError when it is malformed"""
+    request = json.loads(body or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("Expected a JSON object")
+    emotion = request.get("emotion")
+    if not emotion or not isinstance(emotion, str):
+        raise ValueError("emotion is required")
+    probabilities = request.get("probabilities")
+    if probabilities is not None:
+        if (not isinstance(probabilities, list) or len(probabilities) != 7
+                or not all(isinstance(p, (int, float)) and not isinstance(p, bool) and np.isfinite(p)
+                           for p in probabilities)):
+            raise ValueError("probabilities must be a list of 7 numbers")
+        probabilities = [float(p) for p in probabilities]
+    return emotion, probabilities
+
+
+class FeelTuneService:
+    """Model, detector and Spotify client shared by all request threads of a worker"""
+
+    def __init__(self, backend=None, stub_spotify=False, max_batch=64, max_wait=0.005):
+        from emotion_model.emotion_utils import load_emotion_model
+        from emotion_model.face_detector import get_face_detector
+        from emotion_model.result_cache import get_result_cache
+        from recommender.assets import get_asset_cache
+
+        self.ready = False
+        self.assets = get_asset_cache()
+        self.detector = get_face_detector()
+        self.cache = get_result_cache()
+        self.model = load_emotion_model(backend)
+        if stub_spotify:
+            from recommender.stub import StubSpotify
+            self.spotify = StubSpotify()
+        else:
+            from recommender.recommender import setup_spotify
+            self.spotify = setup_spotify()
+        self.batcher = MicroBatcher(self.model, max_batch, max_wait) if self.model is not None else None
+        self.ready = self.batcher is not None
+
+    def detect(self, image_bytes):
+        if not image_bytes:
+            raise ValueError("Empty request body; expected image bytes")
+        with metrics.span("detect.decode"):
+            buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+            try:
+                gray = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+            except cv2.error:
+                gray = None
+        if gray is None:
+            raise ValueError("Could not decode image")
+
+        faces = self._detect_faces(gray)
+        if faces:
+            dominant = max(faces, key=lambda face: face["confidence"])
+            emotion, probabilities = dominant["label"], dominant["probabilities"]
+        else:
+            emotion, probabilities = "sad", None
+        return {"emotion": emotion, "probabilities": probabilities, "faces": faces}
+
+    def _detect_faces(self, gray):
+        from emotion_model.emotion_utils import _crop_face, _face_result
+
+        with metrics.span("detect.cascade"):
+            boxes = [tuple(int(v) for v in box) for box in self.detector.detect(gray)]
+        metrics.observe("faces_per_frame", len(boxes), buckets=metrics.SIZE_BUCKETS)
+        probabilities = [None] * len(boxes)
+        if self.cache is not None:
+            from emotion_model.result_cache import crop_keys, model_namespace
+
+            # Faces that match a recently classified crop skip inference
+            namespace = model_namespace(self.model)
+            keys = crop_keys([(gray, box) for box in boxes])
+            probabilities = [self.cache.get(key, namespace=namespace) for key in keys]
+        missing = [i for i, p in enumerate(probabilities) if p is None]
+        if missing:
+            with metrics.span("detect.preprocess"):
+                crops = [_crop_face(gray, boxes[i]) for i in missing]
+            with metrics.span("detect.batch_wait"):
+                predictions = self.batcher.submit(crops).result(timeout=30)
+            for i, prediction in zip(missing, predictions):
+                probabilities[i] = prediction.copy()
+                if self.cache is not None:
+                    self.cache.put(keys[i], probabilities[i], namespace=namespace)
+        return [_face_result(box, p) for box, p in zip(boxes, probabilities)]
+
+    def recommend(self, emotion, probabilities=None):
+        from recommender.recommender import get_music_recommendations
+
+        songs = get_music_recommendations(emotion, sp=self.spotify, probabilities=probabilities)
+        if self.assets is not None:
+            # Songs whose assets are cached link to /assets/; the rest are
+            # fetched now, so the next request for them is served locally
+            self.assets.prefetch(songs)
+            songs = [self._asset_links(song) for song in songs]
+        return {"songs": songs}
+
+    def _asset_links(self, song):
+        local = self.assets.localize(song)
+        for key in ("image_url", "preview_url"):
+            if local.get(key) != song.get(key):
+                local[key] = "/assets/" + os.path.basename(local[key])
+        return local
+
+    def asset(self, name):
+        """(bytes, content type) of a cached asset, or None"""
+        if not ASSET_NAME.fullmatch(name) or self.assets is None:
+            return None
+        try:
+            with open(self.assets.path(name), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        return data, "image/jpeg" if name.endswith(".jpg") else "audio/mpeg"
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload, content_type="application/json", headers=None):
+            if isinstance(payload, bytes):
+                body = payload
+            else:
+                body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length)
+
+        def do_GET(self):
+            if self.path == "/healthz":
+                self._send(200, {"status": "ok"})
+            elif self.path == "/readyz":
+                self._send(200 if service.ready else 503, {"ready": service.ready})
+            elif self.path == "/metrics":
+                self._send(200, metrics.render_prometheus(), "text/plain; version=0.0.4")
+            elif self.path.startswith("/assets/"):
+                asset = service.asset(self.path[len("/assets/"):])
+                if asset is None:
+                    self._send(404, {"error": "not found"})
+                else:
+                    # Names are hashes of the Spotify URL, whose content never changes
+                    self._send(200, asset[0], asset[1], {"Cache-Control": "public, max-age=86400"})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            try:
+                if self.path == "/detect":
+                    if not service.ready:
+                        self._send(503, {"error": "model not loaded"})
+                        return
+                    with metrics.trace("http.detect"):
+                        result = service.detect(self._body())
+                    self._send(200, result)
+                elif self.path == "/recommend":
+                    emotion, probabilities = parse_recommend_request(self._body())
+                    with metrics.trace("http.recommend"):
+                        result = service.recommend(emotion, probabilities)
+                    self._send(200, result)
+                else:
+                    self._send(404, {"error": "not found"})
+            except ValueError as e:
+                self._send(400, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+    return Handler
+
+
+class ReusePortServer(ThreadingHTTPServer):
+    """Lets several worker processes listen on the same port; the kernel spreads connections"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_bind(self):
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def serve(host, port, backend=None, stub_spotify=False, max_batch=64, max_wait=0.005):
+    service = FeelTuneService(backend, stub_spotify, max_batch, max_wait)
+    metrics.start_exporters()
+    server = ReusePortServer((host, port), make_handler(service))
+    print(f"[pid {os.getpid()}] FeelTune service on http://{host}:{port} (ready={service.ready})", flush=True)
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the FeelTune HTTP inference service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the port")
+    parser.add_argument("--backend", default=None, help="inference backend, see emotion_model.backends")
+    parser.add_argument("--stub-spotify", action="store_true", help="use offline fake Spotify data")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="micro-batching window")
+    args = parser.parse_args(argv)
+
+    options = (args.host, args.port, args.backend, args.stub_spotify, args.max_batch, args.max_wait_ms / 1000)
+    if args.workers <= 1:
+        serve(*options)
+        return
+
+    processes = [multiprocessing.Process(target=serve, args=options, daemon=True) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+
+
+class FeelTuneClient:
+    """Client for the HTTP service in service.py, used as a remote backend by the app"""
+
+    def __init__(self, base_url, timeout=10):
+        # Only imported when the app actually talks to a remote service
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def ready(self):
+        import requests
+
+        try:
+            return self.session.get(f"{self.base_url}/readyz", timeout=self.timeout).ok
+        except requests.RequestException:
+            return False
+
+    def detect(self, image_bytes):
+        """Return {"emotion", "probabilities", "faces"} for an encoded image"""
+        response = self.session.post(f"{self.base_url}/detect", data=image_bytes, timeout=self.timeout,
+                                     headers={"Content-Type": "application/octet-stream"})
+        response.raise_for_status()
+        return response.json()
+
+    def recommend(self, emotion, probabilities=None):
+        response = self.session.post(f"{self.base_url}/recommend", timeout=self.timeout,
+                                     json={"emotion": emotion, "probabilities": probabilities})
+        response.raise_for_status()
+        songs = response.json()["songs"]
+        # Cached artwork and previews are linked relative to the service
+        for song in songs:
+            for key in ("image_url", "preview_url"):
+                if (song.get(key) or "").startswith("/assets/"):
+                    song[key] = self.base_url + song[key]
+        return songs
+
+
+def get_remote_client():
+    """Return a client when FEELTUNE_API_URL is set, else None"""
+    url = os.getenv("FEELTUNE_API_URL")
+    return FeelTuneClient(url) if url else None
@@ -0,0 +1,72 @@
+"""The folded NumPy and ONNX exports must match the Keras model they come from.
+
+    python -m pytest tests/test_export_parity.py
+
+Uses fer.h5 when it is present; otherwise the fer.json architecture gets
+seeded random weights, including non-trivial BatchNorm statistics, so the
+folding is still exercised.
+"""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("keras")
+
+from emotion_model.backends import KERAS_FILES, KerasBackend, NumpyBackend, OnnxBackend  # noqa: E402
+from emotion_model.export import check_parity, fold_model, save_numpy, save_onnx  # noqa: E402
+
+ATOL = 1e-4
+
+
+def fixed_inputs():
+    """Deterministic 48x48 faces: seeded noise plus smooth gradients and flat frames"""
+    rng = np.random.default_rng(1234)
+    noise = rng.random((24, 48, 48, 1), dtype=np.float32)
+    ramp = np.linspace(0.0, 1.0, 48, dtype=np.float32)
+    gradients = np.stack([np.add.outer(ramp * a, ramp * (1 - a)) / 2 for a in (0.0, 0.25, 0.5, 0.75, 1.0)])
+    flat = np.stack([np.full((48, 48), v, np.float32) for v in (0.0, 0.5, 1.0)])
+    return np.concatenate([noise, gradients[..., None], flat[..., None]])
+
+
+@pytest.fixture(scope="module")
+def reference():
+    if os.path.exists(KERAS_FILES[1]):
+        return KerasBackend()
+    backend = KerasBackend(weights_path=None)
+    rng = np.random.default_rng(0)
+    for layer in backend.model.layers:
+        weights = layer.get_weights()
+        if type(layer).__name__ == 'BatchNormalization':
+            gamma, beta, mean, variance = weights
+            weights = [rng.uniform(0.5, 1.5, gamma.shape), rng.normal(0, 0.1, beta.shape),
+                       rng.normal(0, 0.1, mean.shape), rng.uniform(0.5, 1.5, variance.shape)]
+        elif weights:
+            fan_in = int(np.prod(weights[0].shape[:-1]))
+            weights = [rng.normal(0, np.sqrt(2.0 / fan_in), weights[0].shape),
+                       rng.normal(0, 0.01, weights[1].shape)]
+        layer.set_weights([w.astype(np.float32) for w in weights])
+    return backend
+
+
+@pytest.fixture(scope="module")
+def folded(reference):
+    return fold_model(reference.model)
+
+
+def assert_parity(reference, candidate):
+    report = check_parity(reference, candidate, batch=fixed_inputs())
+    assert report['max_abs_diff'] <= ATOL, report
+    assert report['label_agreement'] == 1.0, report
+
+
+def test_numpy_matches_keras(reference, folded, tmp_path):
+    path = save_numpy(*folded, path=str(tmp_path / "fer_folded.npz"))
+    assert_parity(reference, NumpyBackend(path))
+
+
+def test_onnx_matches_keras(reference, folded, tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    path = save_onnx(*folded, path=str(tmp_path / "fer.onnx"))
+    assert_parity(reference, OnnxBackend(path))